@@ -0,0 +1,513 @@
+"""
+Benchmarks for the Personal Finance Transaction Analyzer
+
+Each benchmark is a subcommand:
+
+    python benchmarks.py rss transactions.csv
+    python benchmarks.py amounts --count 20000000
+    python benchmarks.py memory --rows 1000000
+    python benchmarks.py rules --rules 10 1000 5000
+    python benchmarks.py stages --rows 10000 100000 --workers 4
+
+- rss:     peak resident memory of the list-based pipeline vs the streaming
+           one. Every mode runs in its own fresh (spawned) process, because
+           peak RSS only ever goes up inside a single process.
+- amounts: throughput of the integer-only parse_cents() against the original
+           float-based dollar_to_penny(), on the same amount strings. The
+           cached dollar_to_penny() is timed too; --distinct sets how many
+           different amount strings there are (how well it caches). By
+           default a low and a high cardinality run (10,000 and 500,000,
+           far more than AMOUNT_CACHE_SIZE) are both measured.
+- memory:  bytes per row of the cleaned data kept as a list of dicts vs a
+           columnar TransactionStore, measured with tracemalloc.
+- rules:   categorizing descriptions with the compiled RuleSet against
+           checking every rule one by one, for growing numbers of rules.
+           The RuleSet's per-description cache is bypassed.
+- stages:  time every stage of the list pipeline on its own (read_csv,
+           rows_to_dictionaries, clean_rows, compute_income_and_spending,
+           spending_by_category, aggregate, render) for each input size, with
+           its rows/sec and tracemalloc peak (measured in a second, untimed
+           pass). Then the streaming analysis with 1..N worker processes, each
+           in a fresh process, with its speedup, scaling efficiency
+           (speedup / workers) and peak RSS. A worker count the file can't be
+           split for (every worker needs MIN_RANGE_BYTES of it) is skipped
+           and listed, since its extra workers would sit idle;
+           --min-range-bytes lowers that bound to measure scaling on small
+           inputs. Everything is also written to a JSON results file, so runs
+           of two versions can be compared.
+"""
+
+import argparse
+import json
+import multiprocessing
+import platform
+import random
+import re
+import resource
+import os
+import sys
+import tempfile
+import time
+import tracemalloc
+from concurrent.futures import ProcessPoolExecutor
+
+import finance
+import generate_transactions
+
+
+def main(argv: list | None = None) -> None:
+    parser = argparse.ArgumentParser(description="finance.py benchmarks")
+    commands = parser.add_subparsers(dest="command", required=True)
+
+    rss = commands.add_parser("rss", help="compare peak RSS of list vs stream mode")
+    rss.add_argument("path", help="CSV file to analyze")
+
+    amounts = commands.add_parser("amounts", help="parse_cents vs float parsing")
+    amounts.add_argument("--count", type=int, default=20_000_000)
+    amounts.add_argument("--distinct", type=int, nargs="+", default=[10_000, 500_000])
+
+    memory = commands.add_parser("memory", help="memory of dict rows vs columnar store")
+    memory.add_argument("--rows", type=int, default=1_000_000)
+
+    rules = commands.add_parser("rules", help="compiled rules vs one rule at a time")
+    rules.add_argument("--rules", type=int, nargs="+", default=[10, 1_000, 5_000])
+    rules.add_argument("--descriptions", type=int, default=20_000)
+
+    stages = commands.add_parser("stages", help="per-stage throughput and worker scaling")
+    stages.add_argument(
+        "--rows", type=int, nargs="+", default=[10_000, 100_000, 1_000_000, 10_000_000]
+    )
+    stages.add_argument("--workers", type=int, default=os.cpu_count() or 1)
+    stages.add_argument("--min-range-bytes", type=int, default=finance.MIN_RANGE_BYTES)
+    stages.add_argument("--output", default="benchmark_results.json")
+
+    args = parser.parse_args(argv)
+    if args.command == "rss":
+        compare_peak_rss(args.path)
+    elif args.command == "amounts":
+        for distinct in args.distinct:
+            compare_amount_parsers(args.count, distinct)
+    elif args.command == "memory":
+        compare_row_memory(args.rows)
+    elif args.command == "rules":
+        compare_rule_matchers(args.rules, args.descriptions)
+    elif args.command == "stages":
+        benchmark_stages(args.rows, args.workers, args.output, args.min_range_bytes)
+
+
+# ============================================================
+# peak RSS: list-based vs streaming pipeline
+# ============================================================
+
+
+# peak resident memory of this process in KiB (macOS reports bytes)
+def peak_rss_kib() -> int:
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    if sys.platform == "darwin":
+        peak //= 1024
+    return peak
+
+
+# the original main() pipeline, without the printing
+def run_list_pipeline(path: str) -> dict:
+    rows = finance.rows_to_dictionaries(finance.read_csv(path))
+    clean = finance.clean_rows(rows)["clean"]
+    totals = finance.compute_income_and_spending(clean)
+    totals["by_category"] = finance.spending_by_category(clean)
+    return totals
+
+
+# runs inside a fresh child process and reports that process's peak RSS
+def measure_mode(mode: str, path: str) -> int:
+    if mode == "list":
+        run_list_pipeline(path)
+    elif mode == "stream":
+        finance.stream_report(path)
+    return peak_rss_kib()
+
+
+# run every mode in its own spawned process and print the peaks side by side
+def compare_peak_rss(path: str) -> dict:
+    context = multiprocessing.get_context("spawn")
+    peaks = {}
+    # "baseline" is just the interpreter plus imports, nothing parsed
+    for mode in ["baseline", "list", "stream"]:
+        with context.Pool(1) as pool:
+            peaks[mode] = pool.apply(measure_mode, (mode, path))
+
+    baseline = peaks["baseline"]
+    print(f"{'mode':<10}{'peak RSS':>14}{'over baseline':>16}")
+    for mode, peak in peaks.items():
+        print(f"{mode:<10}{peak:>10,} KiB{peak - baseline:>12,} KiB")
+
+    return peaks
+
+
+# ============================================================
+# amount parsing: parse_cents() vs the float round-trip
+# ============================================================
+
+
+# the original dollar_to_penny(), kept here only as the baseline
+def float_dollar_to_penny(dollars: str) -> int:
+    pennies = round(float(dollars) * 100)
+    return pennies
+
+
+# a realistic mix of amount strings, the same for every run
+def sample_amounts(distinct: int = 10_000, seed: int = 42) -> list:
+    rng = random.Random(seed)
+    amounts = []
+    for _ in range(distinct):
+        cents = rng.choice([rng.randint(1, 10_000), rng.randint(1, 1_000_000)])
+        sign = rng.choice(["-", "-", "-", ""])
+        amounts.append(f"{sign}{cents // 100}.{cents % 100:02d}")
+    return amounts
+
+
+# time count calls of parser over the sample amounts, in amounts per second
+def time_parser(parser, amounts: list, count: int) -> float:
+    rounds, rest = divmod(count, len(amounts))
+    tail = amounts[:rest]
+
+    start = time.perf_counter()
+    for _ in range(rounds):
+        for amount in amounts:
+            parser(amount)
+    for amount in tail:
+        parser(amount)
+    elapsed = time.perf_counter() - start
+
+    return count / elapsed
+
+
+# check both parsers agree, then print their throughput
+def compare_amount_parsers(count: int, distinct: int = 10_000) -> dict:
+    amounts = sample_amounts(distinct)
+    for amount in amounts:
+        assert finance.parse_cents(amount) == float_dollar_to_penny(amount), amount
+
+    finance.AMOUNT_CACHE.clear()
+    results = {
+        "float dollar_to_penny": time_parser(float_dollar_to_penny, amounts, count),
+        "parse_cents": time_parser(finance.parse_cents, amounts, count),
+        "dollar_to_penny (cached)": time_parser(finance.dollar_to_penny, amounts, count),
+    }
+
+    print(f"{count:,} amounts each, {distinct:,} distinct")
+    for name, per_second in results.items():
+        print(f"{name:<26}{per_second:>14,.0f} amounts/sec")
+
+    return results
+
+
+# ============================================================
+# memory per row: list of dicts vs columnar store
+# ============================================================
+
+SAMPLE_CATEGORIES = ["Food", "Shopping", "Housing", "Transport", "Entertainment", "Income"]
+
+
+# write a csv of rows random (but repeatable) transactions, malformed rows
+# included at generate_transactions.py's default rates
+def write_sample_csv(path: str, rows: int, seed: int = 42) -> None:
+    generate_transactions.write_transactions(path, rows, seed=seed)
+
+
+# bytes still allocated after build() returns, keeping its result alive
+def retained_bytes(build) -> int:
+    tracemalloc.start()
+    try:
+        before = tracemalloc.get_traced_memory()[0]
+        result = build()
+        # the amount cache is shared by both paths, it isn't part of the rows
+        finance.AMOUNT_CACHE.clear()
+        after = tracemalloc.get_traced_memory()[0]
+    finally:
+        tracemalloc.stop()
+    del result
+    return after - before
+
+
+# the cleaned rows as a list of dicts, like main() keeps them
+def load_dict_rows(path: str) -> list:
+    return finance.clean_rows(finance.rows_to_dictionaries(finance.read_csv(path)))["clean"]
+
+
+# the cleaned rows as a columnar store
+def load_store_rows(path: str) -> finance.TransactionStore:
+    return finance.clean_rows(finance.read_store(path))["clean"]
+
+
+# print the memory the cleaned rows take in both representations
+def compare_row_memory(rows: int) -> dict:
+    with tempfile.TemporaryDirectory() as directory:
+        path = os.path.join(directory, "sample.csv")
+        write_sample_csv(path, rows)
+        results = {
+            "list of dicts": retained_bytes(lambda: load_dict_rows(path)),
+            "TransactionStore": retained_bytes(lambda: load_store_rows(path)),
+        }
+
+    print(f"{rows:,} rows")
+    print(f"{'representation':<20}{'bytes/row':>12}{'MiB per million rows':>24}")
+    for name, size in results.items():
+        per_row = size / rows
+        print(f"{name:<20}{per_row:>12,.1f}{per_row * 1_000_000 / 2**20:>24,.1f}")
+
+    return results
+
+
+# ============================================================
+# categorization rules: compiled RuleSet vs a loop over the rules
+# ============================================================
+
+
+# a made up merchant-like word
+def random_word(rng: random.Random) -> str:
+    return "".join(rng.choice("abcdefghijklmnopqrstuvwxyz") for _ in range(rng.randint(4, 9)))
+
+
+# count keyword rules (and a few regex ones), plus descriptions that
+# sometimes contain one of the keywords
+def sample_rules(count: int, descriptions: int, seed: int = 42) -> tuple:
+    rng = random.Random(seed)
+    rules = [(random_word(rng), rng.choice(SAMPLE_CATEGORIES)) for _ in range(count)]
+    rules += [(r"re:\bstore\s+\d{4}\b", "Shopping"), (r"re:^uber\b", "Transport")]
+
+    texts = []
+    for _ in range(descriptions):
+        words = [random_word(rng) for _ in range(rng.randint(1, 4))]
+        if rng.random() < 0.5:
+            words.insert(rng.randint(0, len(words)), rng.choice(rules[:count])[0])
+        texts.append(" ".join(words).title())
+    return rules, texts
+
+
+# the obvious way: try the rules one by one, keep the earliest match
+def match_one_by_one(rules: list, compiled: list, description: str) -> str | None:
+    text = description.lower()
+    found = None
+    for rule_index, (match, category) in enumerate(rules):
+        if match.startswith("re:"):
+            m = compiled[rule_index].search(description)
+            start = m.start() if m else -1
+        else:
+            start = text.find(match)
+        if start >= 0 and (found is None or (start, rule_index) < found):
+            found = (start, rule_index)
+    return None if found is None else rules[found[1]][1]
+
+
+# time both matchers over the same descriptions, for every rule count
+def compare_rule_matchers(rule_counts: list, descriptions: int) -> dict:
+    results = {}
+    print(f"{'rules':>8}{'RuleSet':>18}{'one by one':>18}  (descriptions/sec)")
+    for count in rule_counts:
+        rules, texts = sample_rules(count, descriptions)
+        rule_set = finance.RuleSet(rules)
+        compiled = [
+            re.compile(match[3:], re.IGNORECASE) if match.startswith("re:") else None
+            for match, _ in rules
+        ]
+
+        start = time.perf_counter()
+        fast = [rule_set.match(text) for text in texts]
+        compiled_rate = len(texts) / (time.perf_counter() - start)
+
+        start = time.perf_counter()
+        slow = [match_one_by_one(rules, compiled, text) for text in texts]
+        loop_rate = len(texts) / (time.perf_counter() - start)
+
+        assert fast == slow
+        results[count] = {"RuleSet": compiled_rate, "one by one": loop_rate}
+        print(f"{count:>8,}{compiled_rate:>18,.0f}{loop_rate:>18,.0f}")
+
+    return results
+
+
+# ============================================================
+# stage by stage throughput and worker scaling
+# ============================================================
+
+
+# the stages of the list pipeline, in order. each one gets the previous
+# stage's result and returns what the next one needs
+def pipeline_stages(path: str) -> list:
+    def clean(rows):
+        return finance.clean_rows(rows)["clean"]
+
+    def compute(clean_rows):
+        finance.compute_income_and_spending(clean_rows)
+        return clean_rows
+
+    def by_category(clean_rows):
+        finance.spending_by_category(clean_rows)
+        return clean_rows
+
+    def aggregate(clean_rows):
+        report = finance.Accumulator()
+        for row in clean_rows:
+            report.add(row)
+        return report
+
+    return [
+        ("read_csv", lambda _: finance.read_csv(path)),
+        ("rows_to_dictionaries", finance.rows_to_dictionaries),
+        ("clean_rows", clean),
+        ("compute_income_and_spending", compute),
+        ("spending_by_category", by_category),
+        ("aggregate", aggregate),
+        ("render", finance.render_report),
+    ]
+
+
+# run the stages once, returning {stage: seconds} or, with traced, {stage:
+# tracemalloc peak bytes} (tracing slows everything down, so never both)
+def run_stages(path: str, traced: bool = False) -> dict:
+    finance.AMOUNT_CACHE.clear()
+    results = {}
+    value = None
+    for name, stage in pipeline_stages(path):
+        if traced:
+            tracemalloc.start()
+            value = stage(value)
+            results[name] = tracemalloc.get_traced_memory()[1]
+            tracemalloc.stop()
+        else:
+            start = time.perf_counter()
+            value = stage(value)
+            results[name] = time.perf_counter() - start
+    return results
+
+
+# runs inside a fresh process: the streaming analysis with some workers, as
+# (seconds, peak RSS in KiB of this process and its workers)
+def measure_workers(path: str, workers: int, min_range_bytes: int) -> tuple:
+    finance.MIN_RANGE_BYTES = min_range_bytes
+    start = time.perf_counter()
+    finance.analyze_files([path], workers)
+    seconds = time.perf_counter() - start
+    children = resource.getrusage(resource.RUSAGE_CHILDREN).ru_maxrss
+    if sys.platform == "darwin":
+        children //= 1024
+    return seconds, max(own_peak_rss_kib(), children)
+
+
+# like peak_rss_kib(), but on linux from VmHWM: ru_maxrss is carried over
+# from the parent into a freshly spawned process, VmHWM starts over
+def own_peak_rss_kib() -> int:
+    try:
+        with open("/proc/self/status") as f:
+            for line in f:
+                if line.startswith("VmHWM:"):
+                    return int(line.split()[1])
+    except OSError:
+        pass
+    return peak_rss_kib()
+
+
+# time the list pipeline stage by stage and the streaming analysis with
+# 1..workers processes, for every input size. prints a table per size and
+# writes every number to output as JSON. analyze_files() gives every worker
+# at least min_range_bytes of the file, so the worker counts a file is too
+# small for are skipped: their extra workers would only sit idle
+def benchmark_stages(
+    sizes: list, workers: int, output: str, min_range_bytes: int = finance.MIN_RANGE_BYTES
+) -> dict:
+    results = {
+        "python": platform.python_version(),
+        "platform": platform.platform(),
+        "cpu_count": os.cpu_count(),
+        "min_range_bytes": min_range_bytes,
+        "sizes": [],
+    }
+    context = multiprocessing.get_context("spawn")
+    finance.MIN_RANGE_BYTES = min_range_bytes
+
+    for rows in sizes:
+        with tempfile.TemporaryDirectory() as directory:
+            path = os.path.join(directory, "sample.csv")
+            write_sample_csv(path, rows)
+
+            seconds = run_stages(path)
+            peaks = run_stages(path, traced=True)
+            stages = {
+                name: {
+                    "seconds": seconds[name],
+                    "rows_per_sec": rows / seconds[name] if seconds[name] else None,
+                    "peak_bytes": peaks[name],
+                }
+                for name in seconds
+            }
+
+            scaling = []
+            unsplittable = []
+            for count in range(1, workers + 1):
+                ranges = len(finance.split_ranges(path, count))
+                if count > 1 and ranges < count:
+                    unsplittable.append(count)
+                    continue
+                with ProcessPoolExecutor(1, mp_context=context) as pool:
+                    job = pool.submit(measure_workers, path, count, min_range_bytes)
+                    elapsed, peak = job.result()
+                speedup = scaling[0]["seconds"] / elapsed if scaling else 1.0
+                scaling.append(
+                    {
+                        "workers": count,
+                        "ranges": ranges,
+                        "seconds": elapsed,
+                        "rows_per_sec": rows / elapsed,
+                        "speedup": speedup,
+                        "efficiency": speedup / count,
+                        "peak_rss_kib": peak,
+                    }
+                )
+
+        results["sizes"].append(
+            {
+                "rows": rows,
+                "stages": stages,
+                "workers": scaling,
+                "unsplittable_workers": unsplittable,
+            }
+        )
+        print_stage_results(rows, stages, scaling, unsplittable, min_range_bytes)
+
+    with open(output, "w") as f:
+        json.dump(results, f, indent=2)
+    print(f"results written to {output}")
+    return results
+
+
+def print_stage_results(
+    rows: int, stages: dict, scaling: list, unsplittable: list, min_range_bytes: int
+) -> None:
+    print(f"\n{rows:,} rows")
+    print(f"{'stage':<30}{'seconds':>10}{'rows/sec':>14}{'peak MiB':>10}")
+    for name, stage in stages.items():
+        per_second = f"{stage['rows_per_sec']:,.0f}" if stage["rows_per_sec"] else "-"
+        print(
+            f"{name:<30}{stage['seconds']:>10.3f}{per_second:>14}"
+            f"{stage['peak_bytes'] / 2**20:>10.1f}"
+        )
+
+    print(
+        f"{'workers':<10}{'seconds':>10}{'rows/sec':>14}{'speedup':>10}"
+        f"{'efficiency':>12}{'peak RSS MiB':>14}"
+    )
+    for run in scaling:
+        print(
+            f"{run['workers']:<10}{run['seconds']:>10.3f}{run['rows_per_sec']:>14,.0f}"
+            f"{run['speedup']:>10.2f}{run['efficiency']:>12.0%}"
+            f"{run['peak_rss_kib'] / 1024:>14.1f}"
+        )
+    if unsplittable:
+        print(
+            f"skipped {', '.join(map(str, unsplittable))} workers: the file doesn't split"
+            f" into that many ranges of {min_range_bytes:,} bytes (see --min-range-bytes)"
+        )
+
+
+if __name__ == "__main__":
+    main()
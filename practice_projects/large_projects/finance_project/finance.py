@@ -31,6 +31,13 @@ Example input row:
 
     2026-01-02,Starbucks,-5.43,Food
 
+Files compressed with gzip, bzip2 or xz (exports.csv.gz, .csv.bz2, .csv.xz)
+are read directly, no matter their name: the format is detected from the
+first bytes of the file. They are decompressed on the fly by a thread of
+their own, ahead of the parser, without temporary files. A compressed file
+can't be cut into byte ranges, so it is always parsed by a single worker,
+and --incremental reads it in full every time.
+
 Internal Representation
 -----------------------
 All monetary values are converted from dollars to integer cents at parse time.
@@ -42,31 +49,178 @@ This guarantees exact arithmetic and avoids floating-point precision errors.
 All calculations are performed using integer cents and converted back to
 formatted dollar strings only when rendering output.
 
+Amounts are parsed straight from their digit string by parse_cents(), never
+through float. Accepted forms:
+    -5.43   +5.43   5.4   .5   1,234.56   (5.43)  ->  -543 for the last one
+Amounts with more than two decimals (like -1.999) are malformed by default.
+With --extra-decimals round they are rounded half away from zero instead.
+
+Usage
+-----
+    python finance.py [FILE_OR_GLOB ...]
+                      [--stream | --pipeline | --columnar | --cache | --incremental |
+                       --sqlite DB]
+                      [--backend python|numpy] [--from DATE] [--to DATE]
+                      [--search QUERY] [--merchants] [--rules RULES.csv] [--rejects]
+                      [--workers N]
+
+With no arguments, transactions.csv in the current directory is analyzed.
+Globs such as "exports/*.csv" are expanded by the program itself, so they
+work even where the shell does not expand them. Files the program writes
+next to an export (FILE.rejects.csv, FILE.fincache, FILE.finstate) are never
+picked up by a glob.
+
+--stream runs every row through parse -> normalize -> validate -> aggregate as
+a chain of generators, so memory stays flat no matter how big the input is.
+Only the totals and a short preview of malformed rows are printed.
+See benchmarks.py for a peak-RSS comparison against the list-based path.
+
+--pipeline streams too, but overlaps I/O with CPU work: a reader thread reads
+the file 1 MiB at a time and cuts it into blocks of whole lines, a parser
+thread turns them into csv rows and the main thread aggregates them. The
+threads are connected by small bounded queues, so a stage that runs ahead
+waits for the next one and memory stays capped at a few MiB. This pays off
+on network mounts and cold disks, where the plain stream sits idle on every
+read; on a file already in the page cache there is nothing to hide, and the
+thread handoffs make it a little slower than --stream.
+
+--columnar loads the rows into a TransactionStore: typed arrays of cents,
+date ordinals and ids into interned string tables. The columns take 20 bytes
+per row; with the string tables and the arrays' spare capacity,
+"benchmarks.py memory" measures 40 to 50 bytes per row, depending on how many
+distinct descriptions there are, against about 360 for a dict.
+
+--cache does the same, but also saves the parsed store next to the input as
+FILE.fincache. Later runs memory-map that file instead of parsing the CSV. The
+cache is only used while the CSV's path, size, modification time and content
+hash (of its first and last MiB) still match, so an edited export is always
+parsed again. Only the parse is cached: every run still cleans the rows and
+aggregates them, since both depend on --rules, --from/--to, --search and the
+other options of that run. On a warm cache those two steps are most of the
+run.
+
+--incremental streams each file, but remembers in FILE.finstate how far it
+got (byte offset, line count) and the report up to there. The next run only
+parses the newly appended tail and folds it into the saved totals. The whole
+already ingested part is hashed on every run (a sequential read, far cheaper
+than parsing it); if any byte of it changed, the file is parsed again from
+the start.
+
+--sqlite DB loads the clean rows into a SQLite database (created if needed)
+and answers the report with indexed aggregate queries. Rows are bulk-loaded
+in large executemany() batches, one transaction per file, in WAL mode. A
+file already in the database is skipped while its path, size, modification
+time, content hash and the cleaning settings still match, and replaced
+otherwise, so one database can collect years of exports. --from/--to limit
+the queries to a date range; --search, --rollup and --query are refused.
+
+--backend numpy loads the columnar rows into NumPy arrays and analyzes them
+with vectorized operations (sign fixing, np.bincount per category sums,
+np.argpartition for the top expenses). The results are identical, in integer
+cents, to the pure Python path. Without NumPy installed it falls back to
+pure Python. Only the summary is printed in this mode.
+
+--from DATE / --to DATE (list, columnar and --sqlite modes) limit the report
+to a date range; the other modes refuse them rather than report every row.
+The range is one linear pass comparing date ordinals, which is cheaper than
+building (and sorting) an index for a single query on every run.
+
+--merchants adds spending per canonical merchant, shown like the category
+table: positive amounts, Income rows left out. Raw descriptions are mapped
+to a merchant name by canonical_merchant(), which drops store numbers, dates,
+reference numbers and known bank prefixes like "refund", "pos purchase" or
+"paypal *", so "Amazon", "Refund Amazon" and "AMAZON #1234 01/05" all count
+as "Amazon", while "Credit Karma" and "PG&E" are left as they are. There are
+far fewer distinct descriptions than rows, so the mapping sits behind a
+bounded LRU cache.
+
+--rules RULES.csv fills in the category of rows that have none (otherwise
+they are malformed). The file has the header "match,category"; a match is a
+keyword (case-insensitive, anywhere in the description) or "re:" followed by
+a regular expression. All rules are compiled into one matcher at startup,
+an Aho-Corasick automaton for the keywords plus one alternation regex for the
+patterns, so a description is scanned once however many rules there are. The
+match that starts first wins; at the same position, the rule listed first.
+
+--rejects writes every malformed row to FILE.rejects.csv, with its line
+number and the reason it was rejected, as the rows are found. The report
+itself only counts malformed rows by reason and shows the first few, so a
+badly broken export takes no more memory (or screen) than a clean one.
+
+--search QUERY limits the report to rows whose description matches. Words
+are lowercased letters and digits; "refund amazon" means both words (AND),
+"amazon OR target" either one, and "amaz*" any word starting with "amaz". The
+query is answered on the distinct descriptions, through an inverted index of
+their tokens built for the run, and the matching rows are then picked out in
+one pass. Only the list and columnar modes apply it, the others refuse it, as
+they do --rollup and --query.
+
+--rollup day|week|month|year and --query CATEGORY FROM TO (list and columnar
+modes) are answered from daily rollups: one array of daily sums per category,
+built in a single pass, plus a prefix-sum array over it. Any date range total
+is then one subtraction, and the week/month/year views are folded from the
+same daily sums. They cover the same rows as the report: --from/--to and
+--search apply to them too.
+
+When more than one file is given, the files are always streamed. With
+--workers N (default: one per CPU core), every file is memory-mapped and cut
+into byte ranges that start and end on newline boundaries, and each range is
+parsed in its own worker process. Every worker sends back a small partial
+report (totals, per-category sums, counts, dirty-row preview) that the parent
+merges in file order, so wall time scales with the number of cores instead of
+the total size of the input, even for a single multi-gigabyte export. The
+result (including dirty-row line numbers) is identical to the serial path.
+
 Outputs
 -------
-A human-readable text report printed to standard output.
+A human-readable text report printed to standard output. The report is
+formatted in full first and written in one go.
 
 Example (simplified):
 
-    TOTAL INCOME:     $2,529.99
-    TOTAL SPENDING:   $1,419.52
-    NET:              $1,110.47
+    TOTAL INCOME:    $2,529.99
+    TOTAL SPENDING:  $1,419.52
+    NET:             $1,110.47
 
     SPENDING BY CATEGORY:
     Housing        $1,200.00
-    Shopping       $  100.00
-    Food           $    5.43
-
-The program may also display:
-- Top N largest spending transactions
-- Counts of parsed vs skipped rows
-- A preview of malformed rows with row numbers
+    Shopping         $100.00
+    Food               $5.43
+
+The program also displays:
+- Top N largest spending transactions, overall and per category (--top N)
+- Counts of parsed vs skipped rows, and of skipped rows by reason
+- A preview of the first malformed rows with their line numbers
+
+Only the summary is printed by default. --rows (list and columnar modes) also
+prints every raw, clean and dirty row first, which is slow on big files.
+
+--profile measures every stage of the run (reading, cleaning, aggregating,
+rendering, ...): wall time, cpu time (worker processes included) and rows.
+The table goes to stderr; --profile-json FILE.json writes the same numbers
+as json. --profile-memory adds the tracemalloc peak of every stage, at the
+price of a several times slower run. Without these options the stages are
+not measured at all.
+
+--metrics FILE writes the run's metrics for a scheduler or a Prometheus
+textfile collector: duration, rows and bytes per second, malformed rows and
+error rates by reason, a latency histogram per pipeline stage and the peak
+RSS of the main and worker processes. The file is in the Prometheus text
+format, or JSON with --metrics-format json, and is replaced atomically.
+
+--format json|ndjson|csv writes the same results as named sections of flat
+records (summary, categories, top_expenses, top_expenses_by_category,
+merchants, dirty_reasons, dirty_preview, and rows / rollup / query when asked
+for) for other programs to read. Amounts are integer cents, except in the
+dirty_preview, where the amount is text as in the reject file ("-10.00",
+"xx.yy"), since it may not have parsed. Every record is written as soon as
+it is ready, nothing is collected into one big string.
 
 Error Handling
 --------------
 Malformed rows (invalid amounts, missing fields, etc.) do not terminate
-execution. Such rows are recorded and reported separately to ensure
-fault-tolerant processing of real-world bank export data.
+execution. Such rows are counted by reason (see DIRTY_REASONS) and reported
+separately to ensure fault-tolerant processing of real-world bank export data.
 
 Intended Final Functionality
 ----------------------------
@@ -82,88 +236,614 @@ This tool is designed as a local, dependency-light analysis utility and does
 not rely on external databases or third-party finance services.
 """
 
+import argparse
+import bisect
+import bz2
+import collections
+import contextlib
 import csv
-
-
-def main() -> None:
-    # get all the rows in a list
-    rows_list = read_csv()
-    print_list(rows_list)
-
-    # turn all rows into dictionaries
-    rows_dictionary = rows_to_dictionaries(rows_list)
-
-    # remove all the invalid rows
-    clean_and_dirty_rows = clean_rows(rows_dictionary)
+import functools
+import glob
+import gzip
+import hashlib
+import heapq
+import io
+import itertools
+import json
+import lzma
+import mmap
+import os
+import queue
+import re
+import sqlite3
+import sys
+import threading
+import time
+import tracemalloc
+from array import array
+from concurrent.futures import ProcessPoolExecutor
+from datetime import date
+from typing import Callable, Iterable, Iterator
+
+# numpy is optional, it is only used by the "numpy" analysis backend
+try:
+    import numpy as np
+except ImportError:
+    np = None
+
+# resource is unix only, it is only used for the peak RSS in --metrics
+try:
+    import resource
+except ImportError:
+    resource = None
+
+# how many malformed rows to keep around for the report preview
+DIRTY_PREVIEW_SIZE = 10
+
+# why a row is malformed, in the order dirty_reason() checks for them
+DIRTY_REASONS = (
+    "bad_amount",
+    "missing_amount",
+    "missing_date",
+    "missing_description",
+    "zero_amount",
+    "missing_category",
+)
+
+# how many distinct amount strings dollar_to_penny() remembers
+AMOUNT_CACHE_SIZE = 1 << 16
+
+# amount string -> cents, filled by dollar_to_penny() until it is full
+AMOUNT_CACHE = {}
+
+# process-wide settings, changed through configure()
+SETTINGS = {
+    # "reject" or "round" amounts with more than two decimals
+    "extra_decimals": "reject",
+    # how many of the largest expenses to report, overall and per category
+    "top_n": 3,
+    # also aggregate per canonical merchant (see canonical_merchant())
+    "merchants": False,
+    # csv file of keyword/pattern -> category rules for uncategorized rows
+    "rules": None,
+    # write every malformed row to FILE.rejects.csv (see RejectWriter)
+    "rejects": False,
+}
+
+# the compiled rules of SETTINGS["rules"], set by configure()
+RULES = None
+
+
+def main(argv: list | None = None) -> None:
+    args = parse_args(argv)
+    paths = expand_paths(args.paths)
+    configure(
+        {
+            "extra_decimals": args.extra_decimals,
+            "top_n": args.top,
+            "merchants": args.merchants,
+            "rules": args.rules,
+            "rejects": args.rejects,
+        }
+    )
+
+    # never write a report file over one of the inputs
+    check_outputs(paths, [args.profile_json, args.metrics, args.sqlite])
+
+    # --profile: time every stage below, and report them at the end.
+    # --metrics needs the stage timings too, but doesn't print them
+    if args.profile_memory and not args.profile_json:
+        args.profile = True
+    profiling = bool(args.profile or args.profile_json or args.metrics)
+    if profiling:
+        start_profiling(args.profile_memory)
+    started = time.perf_counter()
+    try:
+        report = run_report(args, paths)
+    finally:
+        profiler = stop_profiling(args.profile, args.profile_json) if profiling else None
+
+    if args.metrics:
+        metrics = run_metrics(report, profiler.stages, paths, time.perf_counter() - started)
+        write_metrics(args.metrics, metrics, args.metrics_format)
+
+
+# stop before any of the output paths (None for an unused option) could
+# overwrite one of the input files
+def check_outputs(paths: list, outputs: list) -> None:
+    inputs = {os.path.realpath(path) for path in paths}
+    for output in outputs:
+        if output is not None and os.path.realpath(output) in inputs:
+            raise SystemExit(f"refusing to overwrite the input file {output!r}")
+
+
+# analyze the files and print the report, the way the options ask for.
+# returns the report
+def run_report(args: argparse.Namespace, paths: list) -> "Accumulator":
+    # incremental mode: only what was appended since the last run is parsed
+    if args.incremental:
+        with profile_stage("incremental_report") as stage:
+            parsed = {"rows": 0, "bytes": 0}
+            report = merge_all(incremental_report(path, parsed=parsed) for path in paths)
+            stage.rows = parsed["rows"]
+            stage.input_bytes = parsed["bytes"]
+        with profile_stage("render"):
+            output_report(report, args.format)
+        return report
+
+    # sqlite mode: new files are loaded into the database, the report is queried
+    if args.sqlite:
+        with contextlib.closing(SqliteStore(args.sqlite)) as db:
+            # files loaded before are skipped, they count as nothing parsed
+            with profile_stage("sqlite_ingest") as stage:
+                stage.rows = stage.input_bytes = 0
+                for path in paths:
+                    rows = db.ingest(path)
+                    if rows:
+                        stage.rows += rows
+                        stage.input_bytes += os.path.getsize(path)
+            with profile_stage("sqlite_report"):
+                report = db.report(args.date_from, args.date_to)
+        with profile_stage("render"):
+            output_report(report, args.format)
+        return report
+
+    # pipelined mode: reading, parsing and aggregating overlap in three threads
+    if args.pipeline:
+        with profile_stage("pipeline_report") as stage:
+            report = merge_all(pipeline_report(path) for path in paths)
+            stage.rows = report.clean_count + report.dirty_count
+            stage.input_bytes = input_size(paths)
+        with profile_stage("render"):
+            output_report(report, args.format)
+        return report
+
+    # streaming mode: rows flow through one at a time, memory stays flat.
+    # several files are always streamed, split across worker processes.
+    if args.stream or len(paths) > 1:
+        with profile_stage("analyze_files") as stage:
+            report = analyze_files(paths, args.workers)
+            stage.rows = report.clean_count + report.dirty_count
+            stage.input_bytes = input_size(paths)
+        with profile_stage("render"):
+            output_report(report, args.format)
+        return report
+
+    # numpy backend: columnar rows, analyzed with vectorized array operations
+    if args.backend == "numpy":
+        if np is not None:
+            with profile_stage("read_store") as stage:
+                if args.cache:
+                    store, parsed = load_or_parse_store(paths[0])
+                else:
+                    store, parsed = read_store(paths[0]), True
+                stage.rows = len(store)
+                # a store loaded from its cache parsed nothing
+                if parsed:
+                    stage.input_bytes = input_size(paths)
+            with profile_stage("numpy_report") as stage, open_rejects(paths[0]) as rejects:
+                report = numpy_report(store, path=paths[0], rejects=rejects)
+                stage.rows = len(store)
+            with profile_stage("render"):
+                output_report(report, args.format)
+            return report
+        print("numpy is not installed, using the python backend", file=sys.stderr)
+
+    # --format json/ndjson/csv: every section is written as soon as it is ready
+    writer = None if args.format == "text" else RecordWriter(args.format)
+    show_raw_rows = args.rows and writer is None
+
+    # columnar mode: the rows go straight into compact columns, no dicts.
+    # with --cache, a previous run's parse is reloaded from the sidecar file
+    # with --rows, every raw, clean and dirty row is printed before the report
+    if args.cache or args.columnar:
+        with profile_stage("read_store") as stage:
+            if args.cache:
+                rows_dictionary, parsed = load_or_parse_store(paths[0])
+            else:
+                rows_dictionary, parsed = read_store(paths[0]), True
+            stage.rows = len(rows_dictionary)
+            if parsed:
+                stage.input_bytes = input_size(paths)
+        if show_raw_rows:
+            with profile_stage("print_rows") as stage:
+                print_list(rows_dictionary)
+                stage.rows = len(rows_dictionary)
+    else:
+        # get all the rows in a list
+        with profile_stage("read_csv") as stage:
+            rows_list = read_csv(paths[0])
+            stage.rows = len(rows_list)
+            stage.input_bytes = input_size(paths)
+        if show_raw_rows:
+            with profile_stage("print_rows") as stage:
+                print_list(rows_list)
+                stage.rows = len(rows_list)
+
+        # turn all rows into dictionaries
+        with profile_stage("rows_to_dictionaries") as stage:
+            rows_dictionary = rows_to_dictionaries(rows_list)
+            stage.rows = len(rows_dictionary)
+
+    # the dirty rows are only counted by reason and previewed in the report,
+    # with --rejects they all go to the reject file. they are kept in memory
+    # only when --rows prints them
+    report = Accumulator()
+    keep_dirty = show_raw_rows
+    with open_rejects(paths[0]) as rejects:
+
+        def on_dirty(line: int, row: dict, reason: str) -> None:
+            report.add_dirty(paths[0], line, row, reason)
+            if rejects is not None:
+                rejects.write(line, reason, row)
+
+        # remove all the invalid rows
+        with profile_stage("clean_rows") as stage:
+            clean_and_dirty_rows = clean_rows(rows_dictionary, None if keep_dirty else on_dirty)
+            stage.rows = len(rows_dictionary)
+
+        if keep_dirty:
+            with profile_stage("dirty_rows") as stage:
+                add_dirty_rows(report, paths[0], clean_and_dirty_rows, rejects)
+                stage.rows = report.dirty_count
 
     clean = clean_and_dirty_rows["clean"]
-    dirty = clean_and_dirty_rows["dirty"]
-
-    # print the clean rows
-    print("\n clean rows")
-    print_list(clean)
-
-    # print the dirty ones
-    print("\n dirty rows")
-    print_list(dirty)
-
-    # get the income and spending amounts (in dict format)
-    income_and_spending = compute_income_and_spending(clean)
 
-    # extract them
-    income_cents = income_and_spending["total_income"]
-    spending_cents = income_and_spending["total_spending"]
-
-    # calculate the net
-    net_income = net_cents(income_cents, spending_cents)
-
-    print(f"total income in cents: {income_cents}")
-    print(f"total spending in cents: {spending_cents}")
-    print(f"net income: {net_income}")
+    # the machine-readable formats only get the clean rows, the dirty ones
+    # are in the --rejects file
+    if args.rows:
+        with profile_stage("print_rows") as stage:
+            if writer is not None:
+                writer.section("rows", map(row_record, clean))
+            else:
+                print("\n clean rows")
+                print_list(clean)
+                print("\n dirty rows")
+                print_list(clean_and_dirty_rows["dirty"])
+            stage.rows = len(rows_dictionary)
+
+    # --from/--to: only the rows in the date range
+    selected = clean
+    if args.date_from or args.date_to:
+        with profile_stage("date_filter") as stage:
+            selected = select_dates(clean, args.date_from, args.date_to)
+            stage.rows = len(clean)
+        if writer is None:
+            print(f"\n report from {args.date_from or 'the start'} to {args.date_to or 'the end'}")
+
+    # --search: only the rows whose description matches
+    if args.search:
+        with profile_stage("search") as stage:
+            stage.rows = len(selected)
+            selected = select_matching(selected, args.search)
+        if writer is None:
+            print(f"\n report for descriptions matching {args.search!r}")
+
+    # every total in one pass over the clean rows
+    with profile_stage("aggregate") as stage:
+        if isinstance(selected, TransactionStore):
+            report.add_store(selected)
+        else:
+            for row in selected:
+                report.add(row)
+        stage.rows = len(selected)
 
-    # print the spending by category
-    category_spending = spending_by_category(clean)
-    print(f"spending by category: {category_spending}")
+    with profile_stage("render"):
+        if writer is not None:
+            writer.write_report(report)
+        else:
+            if args.rows or args.date_from or args.date_to or args.search:
+                print()
+            print_report(report)
+
+    # daily rollups answer the date range questions without rescanning rows.
+    # they are built from the same rows as the report, filters included
+    if args.rollup or args.query:
+        with profile_stage("rollup") as stage:
+            rollup = DailyRollup.from_rows(selected)
+            stage.rows = len(selected)
+        if args.rollup and writer is not None:
+            writer.section(
+                "rollup",
+                (
+                    {"period": label, "category": category, "amount_cents": amount}
+                    for label, sums in rollup.view(args.rollup).items()
+                    for category, amount in sums.items()
+                ),
+            )
+        elif args.rollup:
+            print(f"\n spending and income by {args.rollup}")
+            print_dict(rollup.view(args.rollup))
+        if args.query:
+            category, start, end = args.query
+            total = rollup.total(None if category == "*" else category, start, end)
+            if writer is not None:
+                query = {"category": category, "start": start, "end": end, "amount_cents": total}
+                writer.section("query", [query], single=True)
+            else:
+                print(f"\n{category} from {start} to {end}: {total}")
+
+    if writer is not None:
+        writer.close()
+    return report
+
+
+# read the command line options
+def parse_args(argv: list | None = None) -> argparse.Namespace:
+    parser = argparse.ArgumentParser(description="Personal finance transaction analyzer")
+    parser.add_argument(
+        "paths",
+        nargs="*",
+        default=["transactions.csv"],
+        metavar="FILE_OR_GLOB",
+        help="CSV files, plain or gzip/bzip2/xz compressed (or glob patterns), to analyze",
+    )
+    parser.add_argument(
+        "--stream",
+        action="store_true",
+        help="stream rows through the pipeline instead of loading them into lists",
+    )
+    parser.add_argument(
+        "--pipeline",
+        action="store_true",
+        help="stream with reading, parsing and aggregating overlapped in threads",
+    )
+    parser.add_argument(
+        "--columnar",
+        action="store_true",
+        help="keep the rows in a compact TransactionStore instead of dicts",
+    )
+    parser.add_argument(
+        "--cache",
+        action="store_true",
+        help="columnar mode, reusing (or writing) a FILE.fincache parse cache",
+    )
+    parser.add_argument(
+        "--format",
+        choices=OUTPUT_FORMATS,
+        default="text",
+        help="text report, or json / ndjson / csv records for other programs",
+    )
+    parser.add_argument(
+        "--rows",
+        action="store_true",
+        help="also print every raw, clean and dirty row (list and columnar modes, slow)",
+    )
+    parser.add_argument(
+        "--from",
+        dest="date_from",
+        type=iso_date,
+        metavar="DATE",
+        help="only report rows on or after this ISO date",
+    )
+    parser.add_argument(
+        "--to",
+        dest="date_to",
+        type=iso_date,
+        metavar="DATE",
+        help="only report rows on or before this ISO date",
+    )
+    parser.add_argument(
+        "--merchants",
+        action="store_true",
+        help="also report totals per canonical merchant",
+    )
+    parser.add_argument(
+        "--rules",
+        metavar="RULES.csv",
+        help="categorize rows with an empty category using match,category rules",
+    )
+    parser.add_argument(
+        "--search",
+        metavar="QUERY",
+        help="only report rows whose description matches, e.g. 'amazon OR target', 'amaz*'",
+    )
+    parser.add_argument(
+        "--rollup",
+        choices=["day", "week", "month", "year"],
+        help="also print the totals of every category per day/week/month/year",
+    )
+    parser.add_argument(
+        "--query",
+        nargs=3,
+        metavar=("CATEGORY", "FROM", "TO"),
+        help="total of CATEGORY ('*' for all) between two ISO dates, inclusive",
+    )
+    parser.add_argument(
+        "--backend",
+        choices=["python", "numpy"],
+        default="python",
+        help="numpy: vectorized analysis of the columnar rows (falls back to python)",
+    )
+    parser.add_argument(
+        "--rejects",
+        action="store_true",
+        help="write every malformed row, with its line and reason, to FILE.rejects.csv",
+    )
+    parser.add_argument(
+        "--incremental",
+        action="store_true",
+        help="only parse what was appended since the last run (FILE.finstate)",
+    )
+    parser.add_argument(
+        "--sqlite",
+        metavar="DB",
+        help="load the rows into the SQLite database DB and query the report from it",
+    )
+    parser.add_argument(
+        "--profile",
+        action="store_true",
+        help="time every pipeline stage, and print the table on stderr",
+    )
+    parser.add_argument(
+        "--profile-json",
+        metavar="FILE.json",
+        help="time every pipeline stage, and write the timings as json to FILE.json",
+    )
+    parser.add_argument(
+        "--profile-memory",
+        action="store_true",
+        help="also trace the peak allocations of every stage (slow), implies --profile "
+        "unless --profile-json is given",
+    )
+    parser.add_argument(
+        "--metrics",
+        metavar="FILE",
+        help="write the run's throughput, error and stage metrics to FILE",
+    )
+    parser.add_argument(
+        "--metrics-format",
+        choices=METRICS_FORMATS,
+        default="prometheus",
+        help="format of the --metrics file",
+    )
+    parser.add_argument(
+        "--workers",
+        type=int,
+        default=os.cpu_count() or 1,
+        help="worker processes used in streaming mode",
+    )
+    parser.add_argument(
+        "--top",
+        type=int,
+        default=SETTINGS["top_n"],
+        help="how many of the largest expenses to show, overall and per category",
+    )
+    parser.add_argument(
+        "--extra-decimals",
+        choices=["reject", "round"],
+        default=SETTINGS["extra_decimals"],
+        help="what to do with amounts that have more than two decimals",
+    )
+    args = parser.parse_args(argv)
+
+    # --query CATEGORY FROM TO: only its dates go through iso_date
+    if args.query:
+        try:
+            args.query[1:] = [iso_date(text) for text in args.query[1:]]
+        except argparse.ArgumentTypeError as error:
+            parser.error(f"argument --query: {error}")
+
+    # a report that quietly ignores a filter is worse than an error
+    mode = report_mode(args, len(expand_paths(args.paths)))
+    if (args.date_from or args.date_to) and mode not in ("list", "--sqlite"):
+        parser.error(f"--from/--to can't be used with {mode}")
+    list_only = {"--search": args.search, "--rollup": args.rollup, "--query": args.query}
+    for option, value in list_only.items():
+        if value and mode != "list":
+            parser.error(f"{option} can't be used with {mode}")
+    return args
+
+
+# argparse type of date options: the date, checked and written as YYYY-MM-DD
+def iso_date(text: str) -> str:
+    try:
+        return date.fromisoformat(text).isoformat()
+    except ValueError:
+        raise argparse.ArgumentTypeError(f"not an ISO date (YYYY-MM-DD): {text!r}") from None
+
+
+# the mode run_report() takes for these options and this many files (after
+# glob expansion), as named in error messages. "list" covers the list,
+# columnar and cache modes, which apply every filter
+def report_mode(args: argparse.Namespace, file_count: int) -> str:
+    if args.incremental:
+        return "--incremental"
+    if args.sqlite:
+        return "--sqlite"
+    if args.pipeline:
+        return "--pipeline"
+    if args.stream:
+        return "--stream"
+    if file_count > 1:
+        return "several files"
+    if args.backend == "numpy" and np is not None:
+        return "--backend numpy"
+    return "list"
+
+
+# change the process-wide settings
+def configure(settings: dict) -> None:
+    global RULES
+    SETTINGS.update(settings)
+    RULES = load_rules(SETTINGS["rules"]) if SETTINGS["rules"] else None
+    # the cached amounts depend on "extra_decimals"
+    AMOUNT_CACHE.clear()
+
+
+# initializer of worker processes: every worker parses rows exactly like the
+# parent does. a worker forked during --profile-memory stops tracing, only
+# the parent's allocations are profiled
+def init_worker(settings: dict) -> None:
+    configure(settings)
+    if tracemalloc.is_tracing():
+        tracemalloc.stop()
 
 
 # read the csv and output a list of all rows
-def read_csv() -> list:
+def read_csv(path: str = "transactions.csv") -> list:
     rows = []
-    with open("transactions.csv", newline="") as f:
+    with open_csv(path) as f:
         reader = csv.reader(f)
-        next(reader)  # skip header
+        next(reader, None)  # skip header
         for row in reader:
             rows.append(row)
     return rows
 
 
-# get all the rows, and take out the invalid ones
-def clean_rows(rows: list) -> dict:
+# get all the rows, and take out the invalid ones. every dirty row also gets
+# its csv line number and the reason it is dirty (one of DIRTY_REASONS).
+# rows are numbered from line 2, right after the header, as no field spans lines.
+# dirty rows are handed to on_dirty(line, row, reason) when it is given, and
+# only kept in "dirty", "dirty_lines" and "dirty_reasons" when it isn't
+def clean_rows(
+    rows: list, on_dirty: Callable[[int, dict, str], None] | None = None
+) -> dict:
+    if isinstance(rows, TransactionStore):
+        return rows.clean(on_dirty)
+
+    clean_and_dirty = {"clean": [], "dirty": [], "dirty_lines": [], "dirty_reasons": []}
+    for line, row in enumerate(rows, 2):
+        reason = dirty_reason(row)
+        if reason is None:
+            clean_and_dirty["clean"].append(row)
+        elif on_dirty is not None:
+            on_dirty(line, row, reason)
+        else:
+            clean_and_dirty["dirty"].append(row)
+            clean_and_dirty["dirty_lines"].append(line)
+            clean_and_dirty["dirty_reasons"].append(reason)
 
-    clean_and_dirty = {"clean": [], "dirty": []}
-    for i in range(len(rows)):
+    return clean_and_dirty
 
-        # first try to convert the dollars into pennies. if not able to, dont add to clean list.
-        try:
-            rows[i]["amount"] = dollar_to_penny(rows[i]["amount"])
-        except ValueError:
-            clean_and_dirty["dirty"].append(rows[i])
-            continue
 
-        # if every key in the dictionary has a value, then dont do anything
-        if (
-            rows[i]["date"]
-            and rows[i]["description"]
-            and rows[i]["amount"]
-            and rows[i]["category"]
-        ):
-            # make sure amount has correct symbol, then append to clean list
-            check_amount_symbol(rows[i])
-            clean_and_dirty["clean"].append(rows[i])
-        else:
-            clean_and_dirty["dirty"].append(rows[i])
+# normalize a single row dictionary in place. returns None if the row is clean,
+# otherwise why it is dirty (one of DIRTY_REASONS)
+def dirty_reason(row: dict) -> str | None:
 
-    return clean_and_dirty
+    # first try to convert the dollars into pennies. if not able to, the row is dirty.
+    try:
+        row["amount"] = dollar_to_penny(row["amount"])
+    except ValueError:
+        return "bad_amount" if row["amount"] else "missing_amount"
+
+    # an empty category can still be filled in by the --rules file
+    if not row["category"] and RULES is not None and row["description"]:
+        row["category"] = RULES.category(row["description"]) or ""
+
+    # every key in the dictionary needs a value
+    if row["date"] and row["description"] and row["amount"] and row["category"]:
+        # make sure amount has correct symbol
+        check_amount_symbol(row)
+        return None
+
+    if not row["date"]:
+        return "missing_date"
+    if not row["description"]:
+        return "missing_description"
+    if not row["amount"]:
+        return "zero_amount"
+    return "missing_category"
 
 
 # takes a dictionary, makes sure the symbol of "amount" is correct
@@ -179,11 +859,11 @@ def check_amount_symbol(row: dict) -> None:
     return
 
 
-# get the 3 top spendings
-
-
 # calculate the spending according to category
 def spending_by_category(rows: list) -> dict:
+    if isinstance(rows, (TransactionStore, SqliteStore)):
+        return rows.spending_by_category()
+
     category_spending = {}
     for row in rows:
 
@@ -202,6 +882,8 @@ def spending_by_category(rows: list) -> dict:
 
 # calculate the total income and the spending amount
 def compute_income_and_spending(clean_rows: list) -> dict:
+    if isinstance(clean_rows, (TransactionStore, SqliteStore)):
+        return clean_rows.income_and_spending()
 
     income_and_spending = {"total_income": 0, "total_spending": 0}
 
@@ -225,9 +907,76 @@ def net_cents(income: int, spending: int) -> int:
 
 
 # convert dollars to pennies
+# the same amount strings (-5.43, -15.49, 2500.00 ...) show up over and over,
+# so the first AMOUNT_CACHE_SIZE distinct ones are remembered. once the cache
+# is full, new strings are just parsed: nothing is evicted, so a file full of
+# unique amounts pays one dict lookup per row, not an LRU's churn. that is
+# not free: a miss costs the lookup and a function call on top of the parse,
+# and with far more distinct amounts than the cache holds this is no faster
+# than calling parse_cents() directly, sometimes slower (see "benchmarks.py
+# amounts"). the lookups are kept, since telling when misses dominate would
+# mean counting every hit, which costs more than the misses do. errors
+# aren't cached.
 def dollar_to_penny(dollars: str) -> int:
-    pennies = round(float(dollars) * 100)
-    return pennies
+    cents = AMOUNT_CACHE.get(dollars)
+    if cents is None:
+        cents = parse_cents(dollars, SETTINGS["extra_decimals"])
+        if len(AMOUNT_CACHE) < AMOUNT_CACHE_SIZE:
+            AMOUNT_CACHE[dollars] = cents
+    return cents
+
+
+# parse a dollar amount string into integer cents, without a float round-trip.
+# handles +/- signs, thousands separators and (parenthesized) negatives.
+# extra_decimals says what to do with more than two decimals: "reject" or "round"
+def parse_cents(text: str, extra_decimals: str = "reject") -> int:
+    # fast path for the usual shape of a bank amount: 123.45 or -123.45.
+    # int() checks the digits before the dot itself; it would also take "_"
+    # separators and non-ASCII digits, which are left to the slow path
+    if text[-3:-2] == "." and text[-2:].isdigit() and text.isascii() and "_" not in text:
+        try:
+            return int(text.replace(".", "", 1))
+        except ValueError:
+            pass
+
+    text = text.strip()
+    negative = False
+
+    # accounting style negative: (12.34)
+    if text[:1] == "(" and text[-1:] == ")":
+        negative = True
+        text = text[1:-1]
+    elif text[:1] == "-":
+        negative = True
+        text = text[1:]
+    elif text[:1] == "+":
+        text = text[1:]
+
+    whole, _, fraction = text.partition(".")
+
+    # 1,234,567 -> every group after the first has exactly three digits
+    if "," in whole:
+        groups = whole.split(",")
+        if not 1 <= len(groups[0]) <= 3 or any(len(g) != 3 for g in groups[1:]):
+            raise ValueError(f"bad thousands separators in amount: {text!r}")
+        whole = "".join(groups)
+
+    digits = whole + fraction
+    # isascii() because isdigit() also accepts things like "²"
+    if not digits or not digits.isascii() or not digits.isdigit():
+        raise ValueError(f"invalid amount: {text!r}")
+
+    if len(fraction) <= 2:
+        cents = int(whole + fraction.ljust(2, "0"))
+    elif extra_decimals == "round":
+        # round half away from zero on the first dropped digit
+        cents = int(whole + fraction[:2])
+        if fraction[2] >= "5":
+            cents += 1
+    else:
+        raise ValueError(f"more than two decimals in amount: {text!r}")
+
+    return -cents if negative else cents
 
 
 # convert pennies to dollars
@@ -243,8 +992,9 @@ def row_to_dictionary(row: list) -> dict:
 
     row_dictionary = {}
 
+    # short rows get empty values so they end up dirty instead of crashing
     for i in range(len(keys)):
-        row_dictionary[keys[i]] = values[i]
+        row_dictionary[keys[i]] = values[i] if i < len(values) else ""
 
     return row_dictionary
 
@@ -260,19 +1010,2754 @@ def rows_to_dictionaries(rows: list) -> list:
     return rows
 
 
+# ============================================================
+# streaming pipeline: parse -> normalize -> validate -> aggregate
+# ============================================================
+# every stage is a generator that passes (line number, row) pairs along,
+# so only one row is alive at a time no matter how big the file is.
+
+
+# yield (line number, row) pairs straight from the csv
+def iter_csv(path: str) -> Iterator[tuple]:
+    with open_csv(path) as f:
+        reader = csv.reader(f)
+        next(reader, None)  # skip header
+        for row in reader:
+            yield reader.line_num, row
+
+
+# turn each row into a dictionary as it flows past
+def iter_dictionaries(rows: Iterable[tuple]) -> Iterator[tuple]:
+    for line, row in rows:
+        yield line, row_to_dictionary(row)
+
+
+# yield only the clean rows, dirty rows are handed to on_dirty(line, row, reason)
+def iter_clean_rows(
+    rows: Iterable[tuple], on_dirty: Callable[[int, dict, str], None]
+) -> Iterator[tuple]:
+    for line, row in rows:
+        reason = dirty_reason(row)
+        if reason is None:
+            yield line, row
+        else:
+            on_dirty(line, row, reason)
+
+
+# run the whole analysis over a file without ever holding all rows in memory
+def stream_report(path: str, preview_size: int = DIRTY_PREVIEW_SIZE) -> "Accumulator":
+    with open_rejects(path) as rejects:
+        return report_from_rows(iter_csv(path), path, preview_size, rejects)
+
+
+# aggregate a stream of (line number, raw row) pairs that came from path.
+# dirty rows are counted, previewed and written to rejects (a RejectWriter)
+def report_from_rows(
+    rows: Iterable[tuple],
+    path: str,
+    preview_size: int = DIRTY_PREVIEW_SIZE,
+    rejects: "RejectWriter | None" = None,
+) -> "Accumulator":
+    report = Accumulator(preview_size=preview_size)
+    report.path = path
+
+    def on_dirty(line: int, row: dict, reason: str) -> None:
+        report.add_dirty(path, line, row, reason)
+        if rejects is not None:
+            rejects.write(line, reason, row)
+
+    for _, row in iter_clean_rows(iter_dictionaries(rows), on_dirty):
+        report.add(row)
+
+    return report
+
+
+# ============================================================
+# pipelined streaming: reader -> parser -> aggregator threads (--pipeline)
+# ============================================================
+# the plain streaming path waits for the disk, then parses, then waits again.
+# here a reader thread pulls blocks of whole lines from the file, a parser
+# thread turns them into csv rows, and the calling thread aggregates. the
+# stages are joined by bounded queues: a stage that gets ahead blocks until
+# the next one catches up, so at most about
+# 2 * PIPELINE_QUEUE_SIZE * PIPELINE_BLOCK_BYTES of input is in flight, and
+# the time spent waiting on a slow disk or network mount overlaps with parsing.
+
+# bytes asked of the operating system per read, large for network mounts
+PIPELINE_READ_BYTES = 1 << 20
+
+# bytes per block handed to the parser (a block always ends on a line
+# boundary). small blocks keep the parsed batches small, which matters more
+# for speed than the number of queue handoffs
+PIPELINE_BLOCK_BYTES = 1 << 16
+
+# blocks (or parsed batches) a queue holds before its producer has to wait
+PIPELINE_QUEUE_SIZE = 16
+
+# marks the end of a queue
+PIPELINE_DONE = object()
+
+
+# iterate items in a thread of its own, handing them over through a bounded
+# queue. an exception in the thread is raised again in the consumer. closing
+# the returned generator stops the thread and waits for it
+def threaded(items: Iterable, maxsize: int = PIPELINE_QUEUE_SIZE) -> Iterator:
+    handoff = queue.Queue(maxsize)
+    stop = threading.Event()
+
+    # put with a timeout, so a consumer that went away never leaves us blocked
+    def put(item) -> bool:
+        while not stop.is_set():
+            try:
+                handoff.put(item, timeout=0.1)
+                return True
+            except queue.Full:
+                continue
+        return False
+
+    def produce() -> None:
+        try:
+            for item in items:
+                if not put(item):
+                    return
+        except BaseException as error:
+            put((PIPELINE_DONE, error))
+        else:
+            put((PIPELINE_DONE, None))
+
+    thread = threading.Thread(target=produce, daemon=True)
+    thread.start()
+    try:
+        while True:
+            item = handoff.get()
+            if type(item) is tuple and item and item[0] is PIPELINE_DONE:
+                if item[1] is not None:
+                    raise item[1]
+                return
+            yield item
+    finally:
+        stop.set()
+        thread.join()
+
+
+# yield blocks of about block_size bytes from a binary file, each one ending
+# right after a newline (the last one may not end with one)
+def read_blocks(f, block_size: int = PIPELINE_BLOCK_BYTES) -> Iterator[bytes]:
+    rest = b""
+    while block := f.read(block_size):
+        block = rest + block
+        cut = block.rfind(b"\n") + 1
+        if cut == 0:
+            rest = block
+            continue
+        rest = block[cut:]
+        yield block[:cut]
+    if rest:
+        yield rest
+
+
+# turn blocks of whole lines into lists of (line number, row) pairs, numbered
+# like iter_csv() does: the header is line 1 and is skipped
+def parse_blocks(blocks: Iterable[bytes]) -> Iterator[list]:
+    lines_before = 0
+    for block in blocks:
+        reader = csv.reader(io.StringIO(block.decode("utf-8"), newline=""))
+        batch = [(lines_before + reader.line_num, row) for row in reader]
+        if lines_before == 0 and batch:
+            batch = batch[1:]  # skip header
+        lines_before += reader.line_num
+        yield batch
+
+
+# stream_report(), with reading and parsing running ahead in their own threads
+def pipeline_report(path: str, preview_size: int = DIRTY_PREVIEW_SIZE) -> "Accumulator":
+    with (
+        open_binary(path, PIPELINE_READ_BYTES) as f,
+        open_rejects(path) as rejects,
+        contextlib.closing(threaded(read_blocks(f))) as blocks,
+        contextlib.closing(threaded(parse_blocks(blocks))) as batches,
+    ):
+        rows = itertools.chain.from_iterable(batches)
+        return report_from_rows(rows, path, preview_size, rejects)
+
+
+# ============================================================
+# compressed exports (gzip, bzip2, xz)
+# ============================================================
+# the format is told by the file's first bytes, not its name. the data is
+# decompressed in a thread of its own (zlib, bz2 and lzma let go of the GIL
+# while they work) and handed to the parser in blocks of whole lines through
+# a bounded queue, so decompressing overlaps with parsing and nothing is ever
+# written to disk.
+
+# format -> (magic bytes, function opening the file for decompressed reading)
+COMPRESSIONS = {
+    "gzip": (b"\x1f\x8b", gzip.open),
+    "bz2": (b"BZh", bz2.open),
+    "xz": (b"\xfd7zXZ\x00", lzma.open),
+}
+
+
+# "gzip" / "bz2" / "xz", or None for a plain file
+def compression(path: str) -> str | None:
+    with open(path, "rb") as f:
+        head = f.read(8)
+    for name, (magic, _) in COMPRESSIONS.items():
+        if head.startswith(magic):
+            return name
+    return None
+
+
+# open path for reading its (decompressed) bytes
+def open_binary(path: str, buffering: int = -1):
+    name = compression(path)
+    if name is None:
+        return open(path, "rb", buffering=buffering)
+    return COMPRESSIONS[name][1](path, "rb")
+
+
+# open path as text lines for csv.reader, like open(path, newline="") does.
+# compressed files are decompressed by a background thread while they are read
+@contextlib.contextmanager
+def open_csv(path: str) -> Iterator[Iterable[str]]:
+    if compression(path) is None:
+        with open(path, newline="") as f:
+            yield f
+        return
+
+    with (
+        open_binary(path) as f,
+        contextlib.closing(threaded(read_blocks(f))) as blocks,
+    ):
+        yield iter_block_lines(blocks)
+
+
+# the text lines of blocks of whole lines, split the way newline="" splits them
+def iter_block_lines(blocks: Iterable[bytes]) -> Iterator[str]:
+    for block in blocks:
+        yield from io.StringIO(block.decode("utf-8"), newline="")
+
+
+# ============================================================
+# report rendering
+# ============================================================
+# every section is formatted into lines first and the whole report goes to
+# stdout in one write, instead of one print() call (and, on a terminal, one
+# flush) per line.
+
+# how many lines write_lines() joins into a single write
+WRITE_CHUNK_LINES = 10_000
+
+
+# cents -> "$1,234.56" or "-$5.43"
+def format_money(cents: int) -> str:
+    dollars, rest = divmod(abs(cents), 100)
+    return f"{'-' if cents < 0 else ''}${dollars:,}.{rest:02d}"
+
+
+# rows of cells -> lines with every column padded to its widest cell. the
+# columns listed in right are right aligned (amounts)
+def table_lines(rows: list, right: tuple = (), indent: str = "") -> list:
+    if not rows:
+        return []
+    widths = [max(len(row[column]) for row in rows) for column in range(len(rows[0]))]
+    lines = []
+    for row in rows:
+        cells = [
+            cell.rjust(width) if column in right else cell.ljust(width)
+            for column, (cell, width) in enumerate(zip(row, widths))
+        ]
+        lines.append(indent + "  ".join(cells).rstrip())
+    return lines
+
+
+# expense row dictionaries as a date / description / category / spent table
+def expense_lines(rows: list, indent: str = "") -> list:
+    cells = [
+        [row["date"], row["description"], row["category"], format_money(-row["amount"])]
+        for row in rows
+    ]
+    return table_lines(cells, right=(3,), indent=indent)
+
+
+# the report as text: totals, spending per category and the top expenses,
+# then the row counts, merchants and the dirty row preview
+def render_report(report: "Accumulator") -> str:
+    income_cents = report.total_income
+    spending_cents = report.total_spending
+
+    lines = table_lines(
+        [
+            ["TOTAL INCOME:", format_money(income_cents)],
+            ["TOTAL SPENDING:", format_money(spending_cents)],
+            ["NET:", format_money(net_cents(income_cents, spending_cents))],
+        ],
+        right=(1,),
+    )
+
+    # biggest spending first, shown as positive amounts
+    spending = sorted(
+        report.spending_by_category().items(), key=lambda item: (item[1], item[0])
+    )
+    lines += ["", "SPENDING BY CATEGORY:"]
+    lines += table_lines(
+        [[category, format_money(-amount)] for category, amount in spending], right=(1,)
+    )
+
+    if report.top_expenses:
+        lines += ["", f"TOP {len(report.top_expenses)} EXPENSES:"]
+        lines += expense_lines(report.largest_expenses())
+
+        lines += ["", "TOP EXPENSES BY CATEGORY:"]
+        for category, rows in report.largest_expenses_by_category().items():
+            lines.append(f"{category}:")
+            lines += expense_lines(rows, indent="  ")
+
+    # spending only, biggest first and shown as positive amounts like above
+    if report.by_merchant:
+        lines += ["", "SPENDING BY MERCHANT:"]
+        lines += table_lines(
+            [
+                [merchant, format_money(-amount), f"{count:,} rows"]
+                for merchant, amount, count in report.merchants_by_spending()
+            ],
+            right=(1, 2),
+        )
+
+    lines += ["", f"ROWS: {report.clean_count:,} clean, {report.dirty_count:,} dirty"]
+    if report.dirty_reasons:
+        lines += table_lines(
+            [[reason, f"{count:,}"] for reason, count in report.dirty_by_reason().items()],
+            right=(1,),
+            indent="  ",
+        )
+    if report.min_cents is not None:
+        lines.append(
+            f"AMOUNTS: smallest {format_money(report.min_cents)}, "
+            f"largest {format_money(report.max_cents)}"
+        )
+
+    if report.dirty_preview:
+        shown = len(report.dirty_preview)
+        lines += ["", f"DIRTY ROWS (first {shown} of {report.dirty_count:,}):"]
+        lines += [
+            f"{path}:{line} {reason} . {row}"
+            for path, line, reason, row in report.dirty_preview
+        ]
+
+    lines.append("")
+    return "\n".join(lines)
+
+
+# print the report with a single write
+def print_report(report: "Accumulator") -> None:
+    sys.stdout.write(render_report(report))
+
+
+# write lines to stdout, WRITE_CHUNK_LINES of them per write call
+def write_lines(lines: Iterable[str]) -> None:
+    write_chunks(line + "\n" for line in lines)
+
+
+# write text pieces to out (stdout by default), WRITE_CHUNK_LINES of them per
+# write call. pieces is consumed lazily, so a generator of rows is never
+# turned into one big string
+def write_chunks(pieces: Iterable[str], out=None) -> None:
+    out = sys.stdout if out is None else out
+    pieces = iter(pieces)
+    while True:
+        chunk = "".join(itertools.islice(pieces, WRITE_CHUNK_LINES))
+        if not chunk:
+            return
+        out.write(chunk)
+
+
+# ============================================================
+# machine-readable output (--format json|ndjson|csv)
+# ============================================================
+# the report goes out as named sections of flat records ("summary",
+# "categories", "top_expenses", ...). every record is encoded and written as
+# soon as it is produced, so even a section with a record per row is never
+# held in memory as one string, and a reader can start on the first sections
+# while later ones are still being worked out.
+#   json:    {"summary": {...}, "categories": [{...}, ...], ...}
+#   ndjson:  one {"section": name, ...record} object per line
+#   csv:     one row per record, "section" first, columns from CSV_FIELDS
+
+OUTPUT_FORMATS = ["text", "json", "ndjson", "csv"]
+
+# every field a record of any section can have, in csv column order
+CSV_FIELDS = [
+    "section",
+    "rank",
+    "period",
+    "date",
+    "description",
+    "category",
+    "merchant",
+    "amount_cents",
+    "rows",
+    "path",
+    "line",
+    "reason",
+    "amount",
+    "start",
+    "end",
+    "total_income_cents",
+    "total_spending_cents",
+    "net_cents",
+    "clean_rows",
+    "dirty_rows",
+    "min_cents",
+    "max_cents",
+]
+
+
+class RecordWriter:
+    def __init__(self, output_format: str, out=None) -> None:
+        self.format = output_format
+        self.out = sys.stdout if out is None else out
+        self.sections = 0
+
+        if output_format == "csv":
+            self.buffer = io.StringIO()
+            self.csv = csv.DictWriter(self.buffer, CSV_FIELDS, lineterminator="\n")
+            self.csv.writeheader()
+            self.out.write(self.take_buffer())
+        elif output_format == "json":
+            self.out.write("{")
+
+    # write one section. single: a section of exactly one record, which json
+    # writes as an object instead of a list
+    def section(self, name: str, records: Iterable[dict], single: bool = False) -> None:
+        write_chunks(self.encode(name, records, single), self.out)
+        self.sections += 1
+
+    def encode(self, name: str, records: Iterable[dict], single: bool) -> Iterator[str]:
+        if self.format == "ndjson":
+            for record in records:
+                yield json.dumps({"section": name, **record}) + "\n"
+        elif self.format == "csv":
+            for record in records:
+                self.csv.writerow({"section": name, **record})
+                yield self.take_buffer()
+        elif single:
+            yield f"{',' if self.sections else ''}\n{json.dumps(name)}: "
+            yield json.dumps(next(iter(records)))
+        else:
+            yield f"{',' if self.sections else ''}\n{json.dumps(name)}: ["
+            separator = "\n  "
+            for record in records:
+                yield separator + json.dumps(record)
+                separator = ",\n  "
+            yield "\n]"
+
+    # what the csv writer wrote since the last call
+    def take_buffer(self) -> str:
+        text = self.buffer.getvalue()
+        self.buffer.seek(0)
+        self.buffer.truncate()
+        return text
+
+    # every section of the text report, as records
+    def write_report(self, report: "Accumulator") -> None:
+        self.section("summary", [summary_record(report)], single=True)
+        self.section(
+            "categories",
+            (
+                {
+                    "category": category,
+                    "amount_cents": amount,
+                    "rows": report.category_counts[category],
+                }
+                for category, amount in report.category_cents.items()
+            ),
+        )
+        self.section("top_expenses", expense_records(report.largest_expenses()))
+        self.section(
+            "top_expenses_by_category",
+            (
+                record
+                for rows in report.largest_expenses_by_category().values()
+                for record in expense_records(rows)
+            ),
+        )
+        if report.by_merchant:
+            self.section(
+                "merchants",
+                (
+                    {"merchant": merchant, "amount_cents": amount, "rows": count}
+                    for merchant, amount, count in report.merchants_by_spending()
+                ),
+            )
+        self.section(
+            "dirty_reasons",
+            (
+                {"reason": reason, "rows": count}
+                for reason, count in report.dirty_by_reason().items()
+            ),
+        )
+        self.section(
+            "dirty_preview",
+            (
+                {
+                    "path": path,
+                    "line": line,
+                    "reason": reason,
+                    "date": row["date"],
+                    "description": row["description"],
+                    "category": row["category"],
+                    "amount": amount_text(row["amount"]),
+                }
+                for path, line, reason, row in report.dirty_preview
+            ),
+        )
+
+    def close(self) -> None:
+        if self.format == "json":
+            self.out.write("\n}\n")
+        self.out.flush()
+
+
+# the totals of a report as one record
+def summary_record(report: "Accumulator") -> dict:
+    return {
+        "total_income_cents": report.total_income,
+        "total_spending_cents": report.total_spending,
+        "net_cents": net_cents(report.total_income, report.total_spending),
+        "clean_rows": report.clean_count,
+        "dirty_rows": report.dirty_count,
+        "min_cents": report.min_cents,
+        "max_cents": report.max_cents,
+    }
+
+
+# expense row dictionaries (largest first) as ranked records
+def expense_records(rows: list) -> Iterator[dict]:
+    for rank, row in enumerate(rows, 1):
+        yield {"rank": rank, **row_record(row)}
+
+
+# a clean row dictionary as a record
+def row_record(row: dict) -> dict:
+    return {
+        "date": row["date"],
+        "description": row["description"],
+        "category": row["category"],
+        "amount_cents": row["amount"],
+    }
+
+
+# print the report in the chosen --format
+def output_report(report: "Accumulator", output_format: str = "text") -> None:
+    if output_format == "text":
+        print_report(report)
+        return
+    writer = RecordWriter(output_format)
+    writer.write_report(report)
+    writer.close()
+
+
+# ============================================================
+# per-stage profiling (--profile)
+# ============================================================
+# main() wraps every stage of the pipeline in profile_stage(). with --profile,
+# each stage records its wall time, cpu time (worker processes included) and
+# rows, and with --profile-memory its tracemalloc peak too. without them,
+# profile_stage() hands back one shared do-nothing object, so the cost is a
+# function call per stage, not per row.
+
+# the StageProfiler of --profile, None while profiling is off
+PROFILER = None
+
+
+class StageProfiler:
+    def __init__(self, trace_memory: bool = False) -> None:
+        self.trace_memory = trace_memory
+        # one dict per finished stage, in the order they ran
+        self.stages = []
+
+    def stage(self, name: str) -> "ProfiledStage":
+        return ProfiledStage(self, name)
+
+    # the stage table, as printed by --profile
+    def table(self) -> str:
+        lines = [
+            f"{'stage':<22}{'wall s':>10}{'cpu s':>10}{'rows':>14}{'rows/s':>14}{'peak MiB':>10}"
+        ]
+        for stage in self.stages:
+            rows = stage["rows"]
+            wall = stage["wall_seconds"]
+            peak = stage["peak_bytes"]
+            rate = f"{rows / wall:,.0f}" if rows is not None and wall > 0 else "-"
+            lines.append(
+                f"{stage['stage']:<22}{wall:>10.3f}{stage['cpu_seconds']:>10.3f}"
+                f"{'-' if rows is None else f'{rows:,}':>14}{rate:>14}"
+                f"{'-' if peak is None else f'{peak / 2**20:.1f}':>10}"
+            )
+        total_wall = sum(stage["wall_seconds"] for stage in self.stages)
+        total_cpu = sum(stage["cpu_seconds"] for stage in self.stages)
+        lines.append(f"{'total':<22}{total_wall:>10.3f}{total_cpu:>10.3f}")
+        return "\n".join(lines) + "\n"
+
+
+# the measurements of one stage, taken around a with block. set .rows inside
+# the block to the number of rows the stage went through. a stage that parses
+# input also sets .input_bytes to the bytes it parsed
+class ProfiledStage:
+    def __init__(self, profiler: StageProfiler, name: str) -> None:
+        self.profiler = profiler
+        self.name = name
+        self.rows = None
+        self.input_bytes = None
+
+    def __enter__(self) -> "ProfiledStage":
+        if self.profiler.trace_memory:
+            tracemalloc.reset_peak()
+        self.wall = time.perf_counter()
+        self.cpu = cpu_seconds()
+        return self
+
+    def __exit__(self, *exc_info) -> None:
+        wall = time.perf_counter() - self.wall
+        cpu = cpu_seconds() - self.cpu
+        peak = tracemalloc.get_traced_memory()[1] if self.profiler.trace_memory else None
+        self.profiler.stages.append(
+            {
+                "stage": self.name,
+                "wall_seconds": wall,
+                "cpu_seconds": cpu,
+                "rows": self.rows,
+                "input_bytes": self.input_bytes,
+                "peak_bytes": peak,
+            }
+        )
+
+
+# what profile_stage() gives out while profiling is off
+class NullStage:
+    rows = None
+    input_bytes = None
+
+    def __enter__(self) -> "NullStage":
+        return self
+
+    def __exit__(self, *exc_info) -> None:
+        return None
+
+
+NULL_STAGE = NullStage()
+
+
+# a context that measures the stage name with --profile, and does nothing otherwise
+def profile_stage(name: str):
+    if PROFILER is None:
+        return NULL_STAGE
+    return PROFILER.stage(name)
+
+
+# cpu seconds of this process and of its finished child processes (workers)
+def cpu_seconds() -> float:
+    times = os.times()
+    return times.user + times.system + times.children_user + times.children_system
+
+
+# trace_memory also tracks the peak of traced allocations per stage, which
+# makes everything several times slower (worker processes are not traced)
+def start_profiling(trace_memory: bool = False) -> None:
+    global PROFILER
+    PROFILER = StageProfiler(trace_memory)
+    if trace_memory:
+        tracemalloc.start()
+
+
+# stop profiling and report the stages: the table on stderr when table is
+# set, and json at json_path unless it is None. returns the profiler
+def stop_profiling(table: bool = True, json_path: str | None = None) -> StageProfiler:
+    global PROFILER
+    profiler, PROFILER = PROFILER, None
+    if profiler.trace_memory:
+        tracemalloc.stop()
+
+    if table:
+        sys.stderr.write(profiler.table())
+    if json_path is not None:
+        text = json.dumps({"stages": profiler.stages}, indent=2) + "\n"
+        write_atomically(json_path, [text.encode("utf-8")])
+    return profiler
+
+
+# ============================================================
+# run metrics (--metrics)
+# ============================================================
+# a metrics file per run, for a scheduler or a prometheus textfile collector.
+# every number comes from totals the run keeps anyway (the report's counts,
+# the profiled stages, rusage), so nothing is counted per row for it.
+
+# upper bounds (seconds) of the stage latency histogram buckets
+STAGE_BUCKETS = (0.001, 0.005, 0.01, 0.05, 0.1, 0.5, 1.0, 5.0, 10.0, 30.0, 60.0, 300.0)
+
+METRICS_FORMATS = ["prometheus", "json"]
+
+
+# the size in bytes of all the files
+def input_size(paths: list) -> int:
+    return sum(os.path.getsize(path) for path in paths)
+
+
+# the metrics of one run, as plain json-able data. rows and bytes per second
+# count only what this run parsed (the stages that set input_bytes): an
+# incremental run parses just the new tail, --sqlite skips files it loaded
+# before. rows and the error rates describe the whole report
+def run_metrics(report: "Accumulator", stages: list, paths: list, seconds: float) -> dict:
+    rows = report.clean_count + report.dirty_count
+    parsing = [stage for stage in stages if stage["input_bytes"] is not None]
+    parsed_rows = sum(stage["rows"] for stage in parsing)
+    input_bytes = sum(stage["input_bytes"] for stage in parsing)
+    return {
+        "duration_seconds": seconds,
+        "input_files": len(paths),
+        "input_bytes": input_bytes,
+        "parsed_rows": parsed_rows,
+        "rows": rows,
+        "clean_rows": report.clean_count,
+        "dirty_rows": report.dirty_count,
+        "rows_per_second": parsed_rows / seconds if seconds > 0 else 0.0,
+        "bytes_per_second": input_bytes / seconds if seconds > 0 else 0.0,
+        "error_rate": report.dirty_count / rows if rows else 0.0,
+        "dirty_rows_by_reason": report.dirty_by_reason(),
+        "error_rate_by_reason": {
+            reason: count / rows for reason, count in report.dirty_by_reason().items()
+        },
+        "stage_seconds": stage_histograms(stages),
+        "peak_rss_bytes": peak_rss_bytes(resource.RUSAGE_SELF) if resource else None,
+        "workers_peak_rss_bytes": peak_rss_bytes(resource.RUSAGE_CHILDREN) if resource else None,
+    }
+
+
+# {stage: {"buckets": [cumulative count per STAGE_BUCKETS bound], "count", "sum"}}
+def stage_histograms(stages: list) -> dict:
+    histograms = {}
+    for stage in stages:
+        seconds = stage["wall_seconds"]
+        histogram = histograms.setdefault(
+            stage["stage"], {"buckets": [0] * len(STAGE_BUCKETS), "count": 0, "sum": 0.0}
+        )
+        for i, bound in enumerate(STAGE_BUCKETS):
+            if seconds <= bound:
+                histogram["buckets"][i] += 1
+        histogram["count"] += 1
+        histogram["sum"] += seconds
+    return histograms
+
+
+# peak resident memory in bytes of this process (RUSAGE_SELF) or of its
+# largest finished child process (RUSAGE_CHILDREN). macOS reports bytes
+def peak_rss_bytes(who: int) -> int:
+    peak = resource.getrusage(who).ru_maxrss
+    return peak if sys.platform == "darwin" else peak * 1024
+
+
+# the metrics without labels: (prometheus name, type, help, key in run_metrics())
+PROMETHEUS_SCALARS = [
+    ("run_duration_seconds", "gauge", "Wall time of the run.", "duration_seconds"),
+    ("input_bytes_total", "counter", "Bytes of input parsed by the run.", "input_bytes"),
+    ("parsed_rows_total", "counter", "Rows parsed by the run.", "parsed_rows"),
+    ("rows_total", "counter", "Rows in the report, clean and dirty.", "rows"),
+    ("clean_rows_total", "counter", "Rows that passed validation.", "clean_rows"),
+    ("rows_per_second", "gauge", "Rows parsed per second of the run.", "rows_per_second"),
+    ("bytes_per_second", "gauge", "Input bytes parsed per second of the run.", "bytes_per_second"),
+]
+
+
+# the metrics in the prometheus text exposition format
+def prometheus_lines(metrics: dict) -> Iterator[str]:
+    # (name, type, help, [(name suffix, labels, value)])
+    families = [
+        (name, kind, help_text, [("", {}, metrics[key])])
+        for name, kind, help_text, key in PROMETHEUS_SCALARS
+    ]
+    families.append(
+        (
+            "dirty_rows_total",
+            "counter",
+            "Malformed rows, by reason.",
+            [("", {"reason": reason}, n) for reason, n in metrics["dirty_rows_by_reason"].items()],
+        )
+    )
+    families.append(
+        (
+            "error_rate",
+            "gauge",
+            "Fraction of all rows that were malformed, by reason.",
+            [("", {"reason": reason}, r) for reason, r in metrics["error_rate_by_reason"].items()],
+        )
+    )
+
+    samples = []
+    for stage, histogram in metrics["stage_seconds"].items():
+        for bound, count in zip(STAGE_BUCKETS, histogram["buckets"]):
+            samples.append(("_bucket", {"stage": stage, "le": bound}, count))
+        samples.append(("_bucket", {"stage": stage, "le": "+Inf"}, histogram["count"]))
+        samples.append(("_sum", {"stage": stage}, histogram["sum"]))
+        samples.append(("_count", {"stage": stage}, histogram["count"]))
+    families.append(
+        ("stage_duration_seconds", "histogram", "Wall time of the pipeline stages.", samples)
+    )
+
+    if metrics["peak_rss_bytes"] is not None:
+        samples = [
+            ("", {"process": "main"}, metrics["peak_rss_bytes"]),
+            ("", {"process": "workers"}, metrics["workers_peak_rss_bytes"]),
+        ]
+        families.append(
+            ("peak_rss_bytes", "gauge", "Peak resident memory, main and worker processes.", samples)
+        )
+
+    for name, kind, help_text, samples in families:
+        yield f"# HELP finance_{name} {help_text}"
+        yield f"# TYPE finance_{name} {kind}"
+        for suffix, labels, value in samples:
+            label_text = ",".join(f'{key}="{label}"' for key, label in labels.items())
+            if label_text:
+                label_text = "{" + label_text + "}"
+            yield f"finance_{name}{suffix}{label_text} {value}"
+
+
+# write the metrics to path (atomically, so a collector never reads half a file)
+def write_metrics(path: str, metrics: dict, metrics_format: str = "prometheus") -> None:
+    if metrics_format == "json":
+        text = json.dumps(metrics, indent=2) + "\n"
+    else:
+        text = "\n".join(prometheus_lines(metrics)) + "\n"
+    write_atomically(path, [text.encode("utf-8")])
+
+
+# ============================================================
+# single-pass aggregation
+# ============================================================
+# an Accumulator computes every statistic of the report while the clean rows
+# stream past once. partial accumulators (from threads, worker processes or
+# cached parts of a file) are combined with merge(), in any grouping.
+
+# the k largest entries seen so far, kept in a min-heap of size k: O(log k) per
+# entry and O(k) memory. entries are tuples compared as a whole, so ties are
+# broken the same way whatever order entries (or merged heaps) arrive in
+class TopN:
+    def __init__(self, k: int) -> None:
+        self.k = k
+        self.heap = []
+
+    def __len__(self) -> int:
+        return len(self.heap)
+
+    # quick check on the first tuple field only, before building an entry
+    def could_enter(self, key) -> bool:
+        heap = self.heap
+        return len(heap) < self.k or (len(heap) > 0 and key >= heap[0][0])
+
+    def add(self, entry: tuple) -> None:
+        heap = self.heap
+        if len(heap) < self.k:
+            heapq.heappush(heap, entry)
+        elif heap and entry > heap[0]:
+            heapq.heapreplace(heap, entry)
+
+    # fold another heap in (for example one built in a worker process)
+    def merge(self, other: "TopN") -> "TopN":
+        for entry in other.heap:
+            self.add(entry)
+        return self
+
+    # the entries, largest first
+    def largest(self) -> list:
+        return sorted(self.heap, reverse=True)
+
+
+# (spent cents, date, description, category) -> row dictionary
+def expense_row(expense: tuple) -> dict:
+    spent, row_date, description, category = expense
+    return {"date": row_date, "description": description, "amount": -spent, "category": category}
+
+
+class Accumulator:
+    def __init__(
+        self, top_n: int | None = None, preview_size: int = DIRTY_PREVIEW_SIZE
+    ) -> None:
+        self.top_n = SETTINGS["top_n"] if top_n is None else top_n
+        self.preview_size = preview_size
+
+        # spending is kept as positive cents, like compute_income_and_spending()
+        self.total_income = 0
+        self.total_spending = 0
+
+        # every category, Income included. the sums keep the amount sign
+        self.category_cents = {}
+        self.category_counts = {}
+
+        # smallest and largest (signed) clean amount
+        self.min_cents = None
+        self.max_cents = None
+
+        # the top_n largest (spent cents, date, description, category), overall
+        # and per spending category
+        self.top_expenses = TopN(self.top_n)
+        self.top_by_category = {}
+
+        # per canonical merchant sums and counts, only when "merchants" is on
+        self.by_merchant = SETTINGS["merchants"]
+        self.merchant_cents = {}
+        self.merchant_counts = {}
+
+        self.clean_count = 0
+        self.dirty_count = 0
+        # {reason: dirty rows}, see DIRTY_REASONS
+        self.dirty_reasons = {}
+        # the first preview_size dirty rows as (path, line, reason, row)
+        self.dirty_preview = []
+
+        # set when the accumulator covers one byte range of a file (stream_range),
+        # rejects_part is the range's own reject file, if any
+        self.path = None
+        self.line_count = 0
+        self.rejects_part = None
+
+    # fold one clean (normalized) row dictionary in
+    def add(self, row: dict) -> None:
+        category = row["category"]
+        amount = row["amount"]
+
+        self.clean_count += 1
+        if category == "Income":
+            self.total_income += amount
+        else:
+            self.total_spending -= amount
+
+        self.category_cents[category] = self.category_cents.get(category, 0) + amount
+        self.category_counts[category] = self.category_counts.get(category, 0) + 1
+
+        if self.min_cents is None or amount < self.min_cents:
+            self.min_cents = amount
+        if self.max_cents is None or amount > self.max_cents:
+            self.max_cents = amount
+
+        # cheap check first, most rows can't make it into either heap
+        if amount < 0 and self.wants_expense(-amount, category):
+            self.add_expense((-amount, row["date"], row["description"], category))
+
+        # merchants are a spending breakdown, like the category table
+        if self.by_merchant and category != "Income":
+            self.add_merchant(canonical_merchant(row["description"]), amount)
+
+    def add_merchant(self, merchant: str, amount: int, count: int = 1) -> None:
+        self.merchant_cents[merchant] = self.merchant_cents.get(merchant, 0) + amount
+        self.merchant_counts[merchant] = self.merchant_counts.get(merchant, 0) + count
+
+    # count a dirty row, keeping it only while the preview has room
+    def add_dirty(self, path: str, line: int, row: dict, reason: str) -> None:
+        self.dirty_count += 1
+        self.dirty_reasons[reason] = self.dirty_reasons.get(reason, 0) + 1
+        if len(self.dirty_preview) < self.preview_size:
+            self.dirty_preview.append((path, line, reason, row))
+
+    # could an expense of spent cents enter the overall or its category's top N
+    def wants_expense(self, spent: int, category: str) -> bool:
+        if self.top_expenses.could_enter(spent):
+            return True
+        top = self.top_by_category.get(category)
+        if top is None:
+            return self.top_n > 0
+        return top.could_enter(spent)
+
+    # offer a (spent cents, date, description, category) expense to the heaps
+    def add_expense(self, expense: tuple) -> None:
+        self.top_expenses.add(expense)
+        category = expense[3]
+        top = self.top_by_category.get(category)
+        if top is None:
+            top = self.top_by_category[category] = TopN(self.top_n)
+        top.add(expense)
+
+    # fold the clean rows of a TransactionStore in, without building row dicts
+    def add_store(self, store: "TransactionStore") -> None:
+        names = store.categories.strings
+        for i, (category_id, amount) in enumerate(zip(store.category_ids, store.cents)):
+            category = names[category_id]
+
+            self.clean_count += 1
+            if category == "Income":
+                self.total_income += amount
+            else:
+                self.total_spending -= amount
+
+            self.category_cents[category] = self.category_cents.get(category, 0) + amount
+            self.category_counts[category] = self.category_counts.get(category, 0) + 1
+
+            if self.min_cents is None or amount < self.min_cents:
+                self.min_cents = amount
+            if self.max_cents is None or amount > self.max_cents:
+                self.max_cents = amount
+
+            # only build the row when it could make it into a heap
+            if amount < 0 and self.wants_expense(-amount, category):
+                row = store.row(i)
+                self.add_expense((-amount, row["date"], row["description"], category))
+
+        # descriptions are already deduplicated, so each one is canonicalized once
+        if self.by_merchant:
+            merchants = [canonical_merchant(text) for text in store.descriptions.strings]
+            income = store.categories.ids.get("Income")
+            for description_id, category_id, amount in zip(
+                store.description_ids, store.category_ids, store.cents
+            ):
+                if category_id != income:
+                    self.add_merchant(merchants[description_id], amount)
+
+    # fold another accumulator into this one, returns self
+    def merge(self, other: "Accumulator") -> "Accumulator":
+        self.total_income += other.total_income
+        self.total_spending += other.total_spending
+        self.clean_count += other.clean_count
+        self.dirty_count += other.dirty_count
+
+        for category, amount in other.category_cents.items():
+            self.category_cents[category] = self.category_cents.get(category, 0) + amount
+        for category, count in other.category_counts.items():
+            self.category_counts[category] = self.category_counts.get(category, 0) + count
+        for merchant, amount in other.merchant_cents.items():
+            self.add_merchant(merchant, amount, other.merchant_counts[merchant])
+        for reason, count in other.dirty_reasons.items():
+            self.dirty_reasons[reason] = self.dirty_reasons.get(reason, 0) + count
+
+        if other.min_cents is not None:
+            if self.min_cents is None or other.min_cents < self.min_cents:
+                self.min_cents = other.min_cents
+        if other.max_cents is not None:
+            if self.max_cents is None or other.max_cents > self.max_cents:
+                self.max_cents = other.max_cents
+
+        self.top_expenses.merge(other.top_expenses)
+        for category, top in other.top_by_category.items():
+            if category in self.top_by_category:
+                self.top_by_category[category].merge(top)
+            else:
+                self.top_by_category[category] = TopN(self.top_n).merge(top)
+
+        room = self.preview_size - len(self.dirty_preview)
+        self.dirty_preview.extend(other.dirty_preview[:room])
+        return self
+
+    # [(merchant, cents, rows)] of the spending rows, biggest spending first
+    def merchants_by_spending(self) -> list:
+        return sorted(
+            (
+                (merchant, amount, self.merchant_counts[merchant])
+                for merchant, amount in self.merchant_cents.items()
+            ),
+            key=lambda entry: (entry[1], entry[0]),
+        )
+
+    # the dirty row counts in DIRTY_REASONS order, whatever order they came in
+    def dirty_by_reason(self) -> dict:
+        return {
+            reason: self.dirty_reasons[reason]
+            for reason in DIRTY_REASONS
+            if reason in self.dirty_reasons
+        }
+
+    # spending per category (Income left out), like spending_by_category()
+    def spending_by_category(self) -> dict:
+        return {
+            category: amount
+            for category, amount in self.category_cents.items()
+            if category != "Income"
+        }
+
+    # the top expenses as row dictionaries, largest first
+    def largest_expenses(self) -> list:
+        return [expense_row(expense) for expense in self.top_expenses.largest()]
+
+    # {category: its top expenses as row dictionaries, largest first}
+    def largest_expenses_by_category(self) -> dict:
+        return {
+            category: [expense_row(expense) for expense in top.largest()]
+            for category, top in self.top_by_category.items()
+        }
+
+    # plain json-able form, for the incremental ingest state
+    def to_dict(self) -> dict:
+        data = dict(vars(self))
+        data["top_expenses"] = self.top_expenses.heap
+        data["top_by_category"] = {
+            category: top.heap for category, top in self.top_by_category.items()
+        }
+        return data
+
+    @classmethod
+    def from_dict(cls, data: dict) -> "Accumulator":
+        accumulator = cls(data["top_n"], data["preview_size"])
+        vars(accumulator).update(data)
+        # json has no tuples
+        accumulator.top_expenses = TopN(accumulator.top_n)
+        accumulator.top_expenses.heap = [tuple(entry) for entry in data["top_expenses"]]
+        accumulator.top_by_category = {}
+        for category, heap in data["top_by_category"].items():
+            top = accumulator.top_by_category[category] = TopN(accumulator.top_n)
+            top.heap = [tuple(entry) for entry in heap]
+        accumulator.dirty_preview = [tuple(entry) for entry in data["dirty_preview"]]
+        return accumulator
+
+
+# ============================================================
+# several files: parse in worker processes, merge partial reports
+# ============================================================
+
+
+# expand glob patterns (and keep plain paths) without listing a file twice
+def expand_paths(patterns: list) -> list:
+    paths = []
+    for pattern in patterns:
+        if glob.has_magic(pattern):
+            matches = [path for path in sorted(glob.glob(pattern)) if not is_sidecar(path)]
+            if not matches:
+                raise SystemExit(f"no files match {pattern!r}")
+        else:
+            matches = [pattern]
+        for path in matches:
+            if path not in paths:
+                paths.append(path)
+    return paths
+
+
+# stream every file and merge the results. with more than one worker, every
+# file is cut into byte ranges and all the ranges are parsed in a process pool
+def analyze_files(paths: list, workers: int = 1) -> Accumulator:
+    if workers <= 1:
+        return merge_all(map(stream_report, paths))
+
+    tasks = []
+    for path in paths:
+        # a compressed file can't be cut, one worker decompresses all of it
+        ranges = [(0, None)] if compression(path) else split_ranges(path, workers)
+        for start, end in ranges:
+            tasks.append((path, start, end))
+
+    # not worth starting a pool for a single small file
+    if len(tasks) <= 1:
+        return merge_all(map(stream_report, paths))
+
+    # map() keeps the input order, so the merged dirty preview is deterministic
+    with ProcessPoolExecutor(
+        max_workers=min(workers, len(tasks)), initializer=init_worker, initargs=(SETTINGS,)
+    ) as pool:
+        task_paths, starts, ends = zip(*tasks)
+        partials = pool.map(stream_range, task_paths, starts, ends)
+        return merge_ranges(partials)
+
+
+# is path one of the files written next to an input: a reject file (or a
+# byte range's FILE.rejects.csv.START part of one), a parse cache or an ingest
+# state. "exports/*.csv" matches reject files, so after one --rejects run the
+# next would analyze them as exports
+def is_sidecar(path: str) -> bool:
+    base, _, start = path.rpartition(".")
+    if start.isdigit() and base.endswith(REJECTS_SUFFIX):
+        return True
+    return path.endswith((REJECTS_SUFFIX, CACHE_SUFFIX, STATE_SUFFIX))
+
+
+# merge a sequence of partial reports into one
+def merge_all(
+    partials: Iterable[Accumulator], preview_size: int = DIRTY_PREVIEW_SIZE
+) -> Accumulator:
+    report = Accumulator(preview_size=preview_size)
+    for partial in partials:
+        report.merge(partial)
+    return report
+
+
+# ============================================================
+# one big file: byte ranges parsed in parallel over a memory map
+# ============================================================
+# ranges always start right after a newline, so no row is ever cut in half.
+# this assumes no quoted field contains a newline, which bank exports never do.
+
+# a range is only split off if every worker gets at least this many bytes
+MIN_RANGE_BYTES = 1 << 20
+
+
+# cut the data part of a csv (everything after the header) into up to
+# parts (start, end) byte ranges that begin and end on line boundaries
+def split_ranges(path: str, parts: int) -> list:
+    size = os.path.getsize(path)
+    if size == 0:
+        return []
+
+    with open(path, "rb") as f, mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ) as mm:
+        data_start = mm.find(b"\n") + 1
+        if data_start == 0 or data_start == size:
+            return []  # header only
+
+        data_size = size - data_start
+        parts = max(1, min(parts, data_size // MIN_RANGE_BYTES))
+
+        bounds = [data_start]
+        for i in range(1, parts):
+            guess = data_start + data_size * i // parts
+            # move forward to the start of the next line
+            newline = mm.find(b"\n", guess - 1)
+            bound = size if newline == -1 else newline + 1
+            if bound > bounds[-1] and bound < size:
+                bounds.append(bound)
+        bounds.append(size)
+
+    return list(zip(bounds, bounds[1:]))
+
+
+# yield the decoded lines of the memory map between start and end
+def iter_mapped_lines(mm: mmap.mmap, start: int, end: int) -> Iterator[str]:
+    mm.seek(start)
+    while mm.tell() < end:
+        yield mm.readline().decode("utf-8")
+
+
+# the text lines of path between the byte offsets start and end. end=None
+# stands for all the lines after the header (how compressed files are read)
+@contextlib.contextmanager
+def open_range(path: str, start: int, end: int | None) -> Iterator[Iterable[str]]:
+    if end is None:
+        with open_csv(path) as f:
+            lines = iter(f)
+            next(lines, None)  # skip header
+            yield lines
+        return
+
+    with open(path, "rb") as f, mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ) as mm:
+        yield iter_mapped_lines(mm, start, end)
+
+
+# worker: aggregate the rows of one byte range. line numbers in the dirty
+# preview are relative to the range, merge_ranges() turns them into file lines.
+# with --rejects, the range's dirty rows go to a reject file of its own (with
+# the same relative line numbers), which merge_ranges() appends in file order
+def stream_range(
+    path: str, start: int, end: int | None, preview_size: int = DIRTY_PREVIEW_SIZE
+) -> Accumulator:
+    part = f"{rejects_path(path)}.{start}" if SETTINGS["rejects"] else None
+    range_rejects = RejectWriter(part, header=False) if part else contextlib.nullcontext()
+    with open_range(path, start, end) as lines, range_rejects as rejects:
+        reader = csv.reader(lines)
+        rows = ((reader.line_num, row) for row in reader)
+        report = report_from_rows(rows, path, preview_size, rejects)
+        report.line_count = reader.line_num
+
+    report.rejects_part = part
+    return report
+
+
+# merge range reports (in file order) and fix up their dirty row line numbers
+def merge_ranges(
+    partials: Iterable[Accumulator], preview_size: int = DIRTY_PREVIEW_SIZE
+) -> Accumulator:
+    report = Accumulator(preview_size=preview_size)
+    current_path = None
+    lines_before = 0
+    for partial in partials:
+        # the first range of every file starts right after the header line
+        first_range = partial.path != current_path
+        if first_range:
+            current_path = partial.path
+            lines_before = 1
+
+        shift_lines(partial, lines_before)
+        if partial.rejects_part:
+            append_rejects(partial.path, partial.rejects_part, lines_before, first_range)
+        lines_before += partial.line_count
+        report.merge(partial)
+
+    return report
+
+
+# turn the range-relative line numbers of a stream_range() report into file
+# line numbers, given how many lines of the file come before the range
+def shift_lines(partial: Accumulator, lines_before: int) -> None:
+    partial.dirty_preview = [
+        (path, lines_before + line, reason, row)
+        for path, line, reason, row in partial.dirty_preview
+    ]
+
+
+# ============================================================
+# rejected rows (FILE.rejects.csv)
+# ============================================================
+# with --rejects, every dirty row is written to a csv next to the input, with
+# its line number and reason. rows are written as they are found, through a
+# large buffer, so a badly broken export costs neither memory nor a write per row.
+
+REJECTS_SUFFIX = ".rejects.csv"
+REJECTS_HEADER = ["line", "reason", "date", "description", "amount", "category"]
+
+# bytes buffered before the reject file is written to
+REJECTS_BUFFER_SIZE = 1 << 20
+
+
+def rejects_path(path: str) -> str:
+    return path + REJECTS_SUFFIX
+
+
+class RejectWriter:
+    def __init__(self, path: str, header: bool = True, append: bool = False) -> None:
+        self.file = open(
+            path,
+            "a" if append else "w",
+            newline="",
+            encoding="utf-8",
+            buffering=REJECTS_BUFFER_SIZE,
+        )
+        self.writer = csv.writer(self.file)
+        if header:
+            self.writer.writerow(REJECTS_HEADER)
+
+    def __enter__(self) -> "RejectWriter":
+        return self
+
+    def __exit__(self, *exc_info) -> None:
+        self.close()
+
+    # one dirty row dictionary. amounts that did parse are written back as dollars
+    def write(self, line: int, reason: str, row: dict) -> None:
+        self.writer.writerow(
+            [
+                line,
+                reason,
+                row["date"],
+                row["description"],
+                amount_text(row["amount"]),
+                row["category"],
+            ]
+        )
+
+    def close(self) -> None:
+        self.file.close()
+
+
+# a RejectWriter for path's reject file with --rejects, otherwise a context
+# that gives None
+def open_rejects(path: str):
+    if SETTINGS["rejects"]:
+        return RejectWriter(rejects_path(path))
+    return contextlib.nullcontext()
+
+
+# count the dirty rows of clean_rows() into report, and write them to rejects
+def add_dirty_rows(
+    report: Accumulator, path: str, clean_and_dirty: dict, rejects: RejectWriter | None
+) -> None:
+    for line, reason, row in zip(
+        clean_and_dirty["dirty_lines"], clean_and_dirty["dirty_reasons"], clean_and_dirty["dirty"]
+    ):
+        report.add_dirty(path, line, row, reason)
+        if rejects is not None:
+            rejects.write(line, reason, row)
+
+
+# move the rows of a byte range's reject file onto the end of path's reject
+# file, turning their range-relative line numbers into file line numbers
+def append_rejects(path: str, part: str, lines_before: int, first: bool) -> None:
+    with (
+        open(part, newline="", encoding="utf-8") as source,
+        RejectWriter(rejects_path(path), header=first, append=not first) as rejects,
+    ):
+        for row in csv.reader(source):
+            row[0] = lines_before + int(row[0])
+            rejects.writer.writerow(row)
+    os.remove(part)
+
+
+# cents -> signed dollar text, like "-5.43"
+def cents_text(cents: int) -> str:
+    dollars, rest = divmod(abs(cents), 100)
+    return f"{'-' if cents < 0 else ''}{dollars}.{rest:02d}"
+
+
+# the amount of a dirty row as text: its cents when the amount parsed (the row
+# is dirty for another reason), otherwise the text it had in the csv
+def amount_text(amount: int | str) -> str:
+    return cents_text(amount) if isinstance(amount, int) else amount
+
+
+# ============================================================
+# columnar transaction store
+# ============================================================
+# one dict per row costs hundreds of bytes. the store keeps every field in its
+# own typed array instead: 8 bytes of cents, a 4 byte date ordinal and two 4 byte
+# ids into shared string tables, so the columns cost 20 bytes per row (plus the
+# string tables and the arrays' spare capacity, see "benchmarks.py memory").
+
+
+# a list of distinct strings, each one stored once and referred to by its id
+class StringTable:
+    def __init__(self) -> None:
+        self.strings = []
+        self.ids = {}
+
+    # the id of text, adding it to the table the first time it is seen
+    def id(self, text: str) -> int:
+        string_id = self.ids.get(text)
+        if string_id is None:
+            string_id = len(self.strings)
+            text = sys.intern(text)
+            self.strings.append(text)
+            self.ids[text] = string_id
+        return string_id
+
+    def __len__(self) -> int:
+        return len(self.strings)
+
+    # a table that already holds strings, in id order
+    @classmethod
+    def from_strings(cls, strings: list) -> "StringTable":
+        table = cls()
+        for text in strings:
+            table.id(text)
+        return table
+
+
+# transactions kept column by column. clean_rows(), spending_by_category() and
+# compute_income_and_spending() all accept a store in place of a list of dicts.
+class TransactionStore:
+    def __init__(
+        self, categories: StringTable | None = None, descriptions: StringTable | None = None
+    ) -> None:
+        self.cents = array("q")
+        self.dates = array("i")  # date.toordinal(), 0 when the date is empty
+        self.category_ids = array("i")
+        self.description_ids = array("i")
+        self.categories = categories if categories is not None else StringTable()
+        self.descriptions = descriptions if descriptions is not None else StringTable()
+
+        # the rare malformed values are kept as text, by row index
+        self.bad_amounts = {}
+        self.bad_dates = {}
+
+    def __len__(self) -> int:
+        return len(self.cents)
+
+    def __iter__(self) -> Iterator[dict]:
+        for i in range(len(self)):
+            yield self.row(i)
+
+    # add a raw csv row. amounts and dates that don't parse are remembered as text
+    def append_row(self, row: list, date_ordinals: dict | None = None) -> None:
+        row = row + [""] * (4 - len(row))
+        row_date, description, amount, category = row[:4]
+        i = len(self.cents)
+
+        try:
+            cents = dollar_to_penny(amount)
+        except ValueError:
+            cents = 0
+            self.bad_amounts[i] = amount
+
+        # dates repeat a lot, so callers can share a cache of parsed ordinals
+        ordinal = date_ordinals.get(row_date) if date_ordinals is not None else None
+        if ordinal is None:
+            ordinal = parse_date_ordinal(row_date)
+            if ordinal is None:
+                ordinal = 0
+                self.bad_dates[i] = row_date
+            elif date_ordinals is not None:
+                date_ordinals[row_date] = ordinal
+
+        self.cents.append(cents)
+        self.dates.append(ordinal)
+        self.category_ids.append(self.categories.id(category))
+        self.description_ids.append(self.descriptions.id(description))
+
+    # row i as the same dictionary row_to_dictionary() would build
+    def row(self, i: int) -> dict:
+        ordinal = self.dates[i]
+        if i in self.bad_dates:
+            row_date = self.bad_dates[i]
+        else:
+            row_date = date.fromordinal(ordinal).isoformat() if ordinal else ""
+
+        return {
+            "date": row_date,
+            "description": self.descriptions.strings[self.description_ids[i]],
+            "amount": self.bad_amounts.get(i, self.cents[i]),
+            "category": self.categories.strings[self.category_ids[i]],
+        }
+
+    # a new store with only the given rows, sharing this store's string tables
+    def take(self, indices: Iterable[int]) -> "TransactionStore":
+        subset = TransactionStore(self.categories, self.descriptions)
+        for i in indices:
+            j = len(subset.cents)
+            if i in self.bad_amounts:
+                subset.bad_amounts[j] = self.bad_amounts[i]
+            if i in self.bad_dates:
+                subset.bad_dates[j] = self.bad_dates[i]
+            subset.cents.append(self.cents[i])
+            subset.dates.append(self.dates[i])
+            subset.category_ids.append(self.category_ids[i])
+            subset.description_ids.append(self.description_ids[i])
+        return subset
+
+    # same rules as clean_rows(): fix the amount signs in place and split the
+    # rows into {"clean": store, "dirty": store}. with on_dirty, the dirty rows
+    # are handed to it as row dicts instead, and "dirty" stays empty
+    def clean(self, on_dirty: Callable[[int, dict, str], None] | None = None) -> dict:
+        empty_category = self.categories.ids.get("")
+        empty_description = self.descriptions.ids.get("")
+        cents = self.cents
+
+        # the --rules category of every distinct description, worked out once
+        rule_categories = None
+        if RULES is not None and empty_category is not None:
+            rule_categories = store_rule_categories(self)
+        income = self.categories.ids.get("Income")
+
+        clean = []
+        dirty = []
+        reasons = []
+        for i in range(len(cents)):
+            amount = cents[i]
+            category_id = self.category_ids[i]
+            # like dirty_reason(), rows whose amount didn't parse are left as they are
+            if (
+                category_id == empty_category
+                and rule_categories is not None
+                and i not in self.bad_amounts
+            ):
+                category_id = self.category_ids[i] = rule_categories[self.description_ids[i]]
+            if (
+                amount == 0
+                or category_id == empty_category
+                or self.description_ids[i] == empty_description
+                or (self.dates[i] == 0 and not self.bad_dates.get(i))
+                or i in self.bad_amounts
+            ):
+                if on_dirty is not None:
+                    on_dirty(i + 2, self.row(i), self.dirty_reason(i, category_id))
+                    continue
+                dirty.append(i)
+                reasons.append(self.dirty_reason(i, category_id))
+                continue
+
+            # income is positive, everything else is spending
+            if (category_id == income) != (amount > 0):
+                cents[i] = -amount
+            clean.append(i)
+
+        return {
+            "clean": self.take(clean),
+            "dirty": self.take(dirty),
+            # rows are numbered from line 2, like clean_rows() does
+            "dirty_lines": [i + 2 for i in dirty],
+            "dirty_reasons": reasons,
+        }
+
+    # why row i is dirty, checked in the same order as dirty_reason() does.
+    # category_id is the row's category after the --rules fill-in
+    def dirty_reason(self, i: int, category_id: int) -> str:
+        if i in self.bad_amounts:
+            return "bad_amount" if self.bad_amounts[i] else "missing_amount"
+        if self.dates[i] == 0 and not self.bad_dates.get(i):
+            return "missing_date"
+        if self.description_ids[i] == self.descriptions.ids.get(""):
+            return "missing_description"
+        if self.cents[i] == 0:
+            return "zero_amount"
+        return "missing_category"
+
+    # same result as spending_by_category() on the equivalent dicts
+    def spending_by_category(self) -> dict:
+        income = self.categories.ids.get("Income")
+        totals = {}
+        for category_id, amount in zip(self.category_ids, self.cents):
+            if category_id != income:
+                totals[category_id] = totals.get(category_id, 0) + amount
+
+        names = self.categories.strings
+        return {names[category_id]: amount for category_id, amount in totals.items()}
+
+    # same result as compute_income_and_spending() on the equivalent dicts
+    def income_and_spending(self) -> dict:
+        income = self.categories.ids.get("Income")
+        total_income = 0
+        total_spending = 0
+        for category_id, amount in zip(self.category_ids, self.cents):
+            if category_id == income:
+                total_income += amount
+            else:
+                total_spending -= amount
+
+        return {"total_income": total_income, "total_spending": total_spending}
+
+
+# ISO date string -> date ordinal, or None when it isn't an ISO date
+def parse_date_ordinal(text: str) -> int | None:
+    if not text:
+        return 0
+    try:
+        return date.fromisoformat(text).toordinal()
+    except ValueError:
+        return None
+
+
+# read a csv straight into a TransactionStore, without building any row lists
+def read_store(path: str = "transactions.csv") -> TransactionStore:
+    store = TransactionStore()
+    date_ordinals = {}
+    with open_csv(path) as f:
+        reader = csv.reader(f)
+        next(reader, None)  # skip header
+        for row in reader:
+            store.append_row(row, date_ordinals)
+    return store
+
+
+# ============================================================
+# time-bucketed rollups
+# ============================================================
+# the clean rows are summed per category and per day once. a prefix-sum array
+# over those daily sums turns any date range total into one subtraction:
+#   total(day a .. day b) = prefix[b + 1] - prefix[a]
+# sums keep the amount sign (spending negative, income positive).
+
+
+class DailyRollup:
+    def __init__(self, first_day: int, days: int) -> None:
+        self.first_day = first_day  # date ordinal of index 0
+        self.days = days
+        self.daily = {}  # category -> array("q") of per-day sums
+        self.prefix = {}  # category -> array("q"), prefix[i] = sum of daily[:i]
+        self.all_prefix = array("q", [0] * (days + 1))  # every category together
+
+    # build the rollups from clean row dicts or a clean TransactionStore, in
+    # one pass. rows without a usable ISO date are left out
+    @classmethod
+    def from_rows(cls, rows) -> "DailyRollup":
+        sums = {}  # (category, day ordinal) -> cents
+        if isinstance(rows, TransactionStore):
+            names = rows.categories.strings
+            for ordinal, category_id, amount in zip(rows.dates, rows.category_ids, rows.cents):
+                if ordinal:
+                    key = (names[category_id], ordinal)
+                    sums[key] = sums.get(key, 0) + amount
+        else:
+            ordinals = {}
+            for row in rows:
+                ordinal = ordinals.get(row["date"])
+                if ordinal is None:
+                    ordinal = ordinals[row["date"]] = parse_date_ordinal(row["date"]) or 0
+                if ordinal:
+                    key = (row["category"], ordinal)
+                    sums[key] = sums.get(key, 0) + row["amount"]
+
+        if not sums:
+            return cls(0, 0)
+
+        first_day = min(day for _, day in sums)
+        rollup = cls(first_day, max(day for _, day in sums) - first_day + 1)
+        for (category, day), amount in sums.items():
+            daily = rollup.daily.get(category)
+            if daily is None:
+                daily = rollup.daily[category] = array("q", [0] * rollup.days)
+            daily[day - first_day] += amount
+
+        for category, daily in rollup.daily.items():
+            prefix = rollup.prefix[category] = array("q", [0] * (rollup.days + 1))
+            running = 0
+            for i, amount in enumerate(daily):
+                running += amount
+                prefix[i + 1] = running
+                rollup.all_prefix[i + 1] += running
+        return rollup
+
+    # (start, end) ISO dates or date ordinals -> clamped index range [a, b)
+    def index_range(self, start, end) -> tuple:
+        if isinstance(start, str):
+            start = date.fromisoformat(start).toordinal()
+        if isinstance(end, str):
+            end = date.fromisoformat(end).toordinal()
+        a = min(max(start - self.first_day, 0), self.days)
+        b = min(max(end - self.first_day + 1, 0), self.days)
+        return a, max(a, b)
+
+    # total cents of category (None = every category) from start to end, both
+    # inclusive, in constant time
+    def total(self, category: str | None, start, end) -> int:
+        prefix = self.all_prefix if category is None else self.prefix.get(category)
+        if prefix is None:
+            return 0
+        a, b = self.index_range(start, end)
+        return prefix[b] - prefix[a]
+
+    # {bucket label: {category: cents}} for period "day", "week" (ISO weeks),
+    # "month" or "year", folded from the daily sums
+    def view(self, period: str) -> dict:
+        buckets = {}
+        for i in range(self.days):
+            label = bucket_label(date.fromordinal(self.first_day + i), period)
+            bucket = buckets.get(label)
+            for category, daily in self.daily.items():
+                amount = daily[i]
+                if amount:
+                    if bucket is None:
+                        bucket = buckets[label] = {}
+                    bucket[category] = bucket.get(category, 0) + amount
+        return buckets
+
+
+# the name of the day/week/month/year bucket a date falls into
+def bucket_label(day: date, period: str) -> str:
+    if period == "day":
+        return day.isoformat()
+    if period == "week":
+        year, week, _ = day.isocalendar()
+        return f"{year}-W{week:02d}"
+    if period == "month":
+        return f"{day.year}-{day.month:02d}"
+    if period == "year":
+        return str(day.year)
+    raise ValueError(f"unknown period: {period!r}")
+
+
+# ============================================================
+# date range filter
+# ============================================================
+# one pass over the clean rows, comparing date ordinals. the rows keep their
+# file order. a sorted index over the dates would have to be built (and
+# sorted) on every run, which costs more than the scan it saves.
+
+
+# the clean rows dated from start to end (ISO dates, both inclusive, None =
+# open): a list of dicts, or a new store. rows without a usable ISO date
+# can't fall in any range and are left out
+def select_dates(rows, start: str | None = None, end: str | None = None):
+    low = date.fromisoformat(start).toordinal() if start else 1
+    high = date.fromisoformat(end).toordinal() if end else date.max.toordinal()
+    if isinstance(rows, TransactionStore):
+        return rows.take(i for i, ordinal in enumerate(rows.dates) if low <= ordinal <= high)
+
+    ordinals = {}
+    selected = []
+    for row in rows:
+        ordinal = ordinals.get(row["date"])
+        if ordinal is None:
+            ordinal = ordinals[row["date"]] = parse_date_ordinal(row["date"]) or 0
+        if low <= ordinal <= high:
+            selected.append(row)
+    return selected
+
+
+# ============================================================
+# merchant-name normalization
+# ============================================================
+
+# how many distinct raw descriptions canonical_merchant() remembers
+MERCHANT_CACHE_SIZE = 1 << 16
+
+# bumped whenever canonical_merchant() maps names differently (or other rows
+# are counted per merchant), so the merchant names a --sqlite database stored
+# are loaded again and saved incremental reports are thrown away
+MERCHANT_NAMES_VERSION = 4
+
+# store numbers, dates and long reference/terminal numbers
+MERCHANT_NOISE = re.compile(
+    r"#\s*\d+"
+    r"|\b\d{1,4}[/.-]\d{1,2}(?:[/.-]\d{2,4})?\b"
+    r"|\b(?:store|str|no|nr)\.?\s*\d+\b"
+    r"|\b\d{4,}\b",
+    re.IGNORECASE,
+)
+# "-" and "." only inside a word: "7-Eleven", "Amazon.com"
+MERCHANT_WORD = re.compile(r"[A-Za-z0-9&']+(?:[-.][A-Za-z0-9&']+)*")
+
+# the transaction type banks and payment processors put in front of the
+# merchant name. only these exact phrases are dropped: a merchant whose own
+# name starts with "credit", "card" or "online" keeps it
+MERCHANT_PREFIX = re.compile(
+    r"\s*(?:(?:pos\s+purchase|debit\s+card\s+purchase|recurring\s+payment|refund)\b"
+    r"|(?:paypal|sq|tst)\s*\*)",
+    re.IGNORECASE,
+)
+
+
+# raw description -> canonical merchant name:
+#   "Refund Amazon"                      -> "Amazon"
+#   "POS PURCHASE STARBUCKS #1234 01/05" -> "Starbucks"
+#   "PAYPAL *PG&E"                       -> "PG&E"
+#   "Credit Karma"                       -> "Credit Karma"
+#   "ABC Store 12"                       -> "ABC"
+#   "WAL-MART #4521"                     -> "Wal-Mart"
+# cached, because the same raw descriptions come back over and over
+@functools.lru_cache(maxsize=MERCHANT_CACHE_SIZE)
+def canonical_merchant(description: str) -> str:
+    text = MERCHANT_NOISE.sub(" ", description)
+
+    # "paypal *netflix" style: keep dropping prefixes while a name is left
+    while (prefix := MERCHANT_PREFIX.match(text)) and MERCHANT_WORD.search(text, prefix.end()):
+        text = text[prefix.end() :]
+
+    words = MERCHANT_WORD.findall(text)
+    if not words:
+        return description.strip()
+    # judged on the whole description, the noise words tell too
+    shouting = not any(ch.islower() for ch in description)
+    return " ".join(merchant_word(word, shouting) for word in words)
+
+
+# one word of a merchant name. lowercase words are capitalized, every part
+# of a hyphenated one ("Wal-Mart"). in a mixed case description an all caps
+# word is an acronym ("CVS") and stays as it is; in an all caps one that
+# can't be told, so only "&" names keep caps
+def merchant_word(word: str, shouting: bool) -> str:
+    if "&" in word:
+        return word.upper()
+    if shouting or word.islower():
+        return "-".join(part.capitalize() for part in word.split("-"))
+    return word
+
+
+# ============================================================
+# keyword rules engine for uncategorized rows
+# ============================================================
+
+# how many distinct descriptions a RuleSet remembers the category of
+RULE_CACHE_SIZE = 1 << 16
+
+
+# Aho-Corasick automaton: finds every keyword occurring in a text in a single
+# scan of the text, however many keywords there are
+class KeywordMatcher:
+    def __init__(self, keywords: list) -> None:
+        # keywords: [(lowercase keyword, rule index)]
+        self.goto = [{}]  # state -> {character: next state}
+        self.fail = [0]
+        # best match ending in a state, fail chain included: (length, -rule index)
+        self.best = [None]
+        self.longest = 0
+
+        for keyword, rule_index in keywords:
+            if not keyword:
+                continue
+            state = 0
+            for ch in keyword:
+                next_state = self.goto[state].get(ch)
+                if next_state is None:
+                    next_state = len(self.goto)
+                    self.goto[state][ch] = next_state
+                    self.goto.append({})
+                    self.fail.append(0)
+                    self.best.append(None)
+                state = next_state
+            candidate = (len(keyword), -rule_index)
+            if self.best[state] is None or candidate > self.best[state]:
+                self.best[state] = candidate
+            self.longest = max(self.longest, len(keyword))
+
+        # breadth first, so a state's fail target is always finished before it
+        queue = collections.deque()
+        for next_state in self.goto[0].values():
+            queue.append(next_state)  # depth one states fail back to the root
+        while queue:
+            state = queue.popleft()
+            for ch, next_state in self.goto[state].items():
+                queue.append(next_state)
+                fallback = self.fail[state]
+                while fallback and ch not in self.goto[fallback]:
+                    fallback = self.fail[fallback]
+                self.fail[next_state] = self.goto[fallback].get(ch, 0)
+
+                # the state's own keyword is longer (starts earlier) than any
+                # on its fail chain, so it only inherits when it has none
+                if self.best[next_state] is None:
+                    self.best[next_state] = self.best[self.fail[next_state]]
+
+    # (start, rule index) of the earliest starting keyword in text, first rule
+    # on ties, or None
+    def find(self, text: str) -> tuple | None:
+        goto = self.goto
+        fail = self.fail
+        best = self.best
+        found = None
+        state = 0
+        for position, ch in enumerate(text):
+            # nothing that ends from here on can start before what was found
+            if found is not None and position - self.longest >= found[0]:
+                break
+            while state and ch not in goto[state]:
+                state = fail[state]
+            state = goto[state].get(ch, 0)
+            match = best[state]
+            if match is not None:
+                candidate = (position - match[0] + 1, -match[1])
+                if found is None or candidate < found:
+                    found = candidate
+        return found
+
+
+# keyword and pattern rules compiled into one matcher. category() gives the
+# category for a description, cached per distinct description
+class RuleSet:
+    def __init__(self, rules: list, signature: str = "") -> None:
+        # rules: [(match, category)], a match is a keyword or "re:" + pattern
+        self.categories = [category for _, category in rules]
+        self.signature = signature
+
+        keywords = []
+        patterns = []
+        for rule_index, (match, _) in enumerate(rules):
+            if match.startswith("re:"):
+                patterns.append(f"(?P<r{rule_index}>{match[3:]})")
+            else:
+                keywords.append((match.lower(), rule_index))
+
+        self.keywords = KeywordMatcher(keywords)
+        self.pattern = re.compile("|".join(patterns), re.IGNORECASE) if patterns else None
+        self.category = functools.lru_cache(maxsize=RULE_CACHE_SIZE)(self.match)
+
+    # the category of the rule whose match starts first in description (rule
+    # order breaks ties), or None. use category(), which is cached
+    def match(self, description: str) -> str | None:
+        found = self.keywords.find(description.lower())
+        if self.pattern is not None:
+            m = self.pattern.search(description)
+            if m is not None:
+                candidate = (m.start(), int(m.lastgroup[1:]))
+                if found is None or candidate < found:
+                    found = candidate
+        return None if found is None else self.categories[found[1]]
+
+
+# read a match,category rules csv and compile it
+def load_rules(path: str) -> RuleSet:
+    with open(path, "rb") as f:
+        signature = hashlib.blake2b(f.read(), digest_size=16).hexdigest()
+
+    rules = []
+    with open(path, newline="", encoding="utf-8") as f:
+        reader = csv.reader(f)
+        next(reader, None)  # skip header
+        for row in reader:
+            if len(row) >= 2 and row[0] and row[1]:
+                rules.append((row[0].strip(), row[1].strip()))
+    return RuleSet(rules, signature)
+
+
+# description id -> category id from the rules (the empty category's id when
+# no rule matches), for every distinct description of the store
+def store_rule_categories(store: TransactionStore) -> list:
+    empty_category = store.categories.id("")
+    rule_categories = []
+    for text in store.descriptions.strings:
+        category = RULES.category(text) if text else None
+        rule_categories.append(store.categories.id(category) if category else empty_category)
+    return rule_categories
+
+
+# ============================================================
+# description search (--search)
+# ============================================================
+# descriptions repeat a lot, so the query is answered on the distinct
+# descriptions, through an inverted index of their tokens:
+#   token -> ids of the distinct descriptions containing it
+# and the matching rows are then picked out in one pass over the rows'
+# description ids. the index is built per run; on its own it saves the
+# tokenizing of every row, not the pass over them.
+
+TOKEN_PATTERN = re.compile(r"[a-z0-9]+")
+
+
+# "Refund Amazon #12" -> ["refund", "amazon", "12"]
+def description_tokens(text: str) -> list:
+    return TOKEN_PATTERN.findall(text.lower())
+
+
+class TokenIndex:
+    # index a list of distinct descriptions, ids are their positions
+    def __init__(self, descriptions: list) -> None:
+        self.postings = {}  # token -> set of description ids
+        for description_id, text in enumerate(descriptions):
+            for token in description_tokens(text):
+                self.postings.setdefault(token, set()).add(description_id)
+        self.sorted_tokens = sorted(self.postings)  # for prefix queries
+
+    # description ids for one query word; "amaz*" matches every token starting
+    # with "amaz", found by bisecting the sorted token list
+    def term(self, word: str) -> set:
+        if not word.endswith("*"):
+            return self.postings.get(word, set())
+
+        prefix = word[:-1]
+        matches = set()
+        start = bisect.bisect_left(self.sorted_tokens, prefix)
+        for token in itertools.islice(self.sorted_tokens, start, None):
+            if not token.startswith(prefix):
+                break
+            matches |= self.postings[token]
+        return matches
+
+    # description ids matching query. words next to each other must all match
+    # (AND, the keyword is optional), OR separates alternatives
+    def search(self, query: str) -> set:
+        matched = set()
+        for alternative in re.split(r"\s+OR\s+", query.strip()):
+            words = [w for w in alternative.split() if w != "AND"]
+            terms = [self.term(w.lower()) if w.endswith("*") else self.term_words(w) for w in words]
+            if terms:
+                matched |= set.intersection(*terms)
+        return matched
+
+    # a plain query word may itself hold several tokens ("7-eleven"), all must match
+    def term_words(self, word: str) -> set:
+        tokens = description_tokens(word)
+        if not tokens:
+            return set()
+        return set.intersection(*(self.term(token) for token in tokens))
+
+
+# the rows whose description matches query, in their original order: a list
+# of dicts, or a new store
+def select_matching(rows, query: str):
+    if isinstance(rows, TransactionStore):
+        matched = TokenIndex(rows.descriptions.strings).search(query)
+        return rows.take(i for i, d in enumerate(rows.description_ids) if d in matched)
+
+    table = StringTable()
+    description_ids = [table.id(row["description"]) for row in rows]
+    matched = TokenIndex(table.strings).search(query)
+    return [row for row, d in zip(rows, description_ids) if d in matched]
+
+
+# ============================================================
+# numpy backend
+# ============================================================
+# the columns of a TransactionStore are viewed as numpy arrays (no copy) and
+# every step of clean() and the Accumulator is done on whole arrays at once.
+# everything stays int64, so the results match the python path to the cent.
+
+# float64 sums of integers are exact as long as no partial sum reaches this
+FLOAT_EXACT_LIMIT = 2**53
+
+
+# the store's columns as numpy arrays
+def numpy_columns(store: TransactionStore) -> tuple:
+    return (
+        np.frombuffer(store.cents, dtype=np.int64),
+        np.frombuffer(store.dates, dtype=np.int32),
+        np.frombuffer(store.category_ids, dtype=np.int32),
+        np.frombuffer(store.description_ids, dtype=np.int32),
+    )
+
+
+# boolean mask with True at the given row indices
+def numpy_mask(size: int, indices: Iterable[int]) -> "np.ndarray":
+    mask = np.zeros(size, dtype=bool)
+    mask[np.fromiter(indices, dtype=np.int64)] = True
+    return mask
+
+
+# per category sums of values (int64). np.bincount adds in float64, which is
+# exact for integers as long as the sum of all |values| stays below 2**53;
+# past that, the slower but always exact np.add.at is used
+def numpy_category_sums(category_ids: "np.ndarray", values: "np.ndarray", size: int):
+    if np.abs(values).sum() < FLOAT_EXACT_LIMIT:
+        sums = np.bincount(category_ids, weights=values, minlength=size)
+        return sums.astype(np.int64)
+
+    sums = np.zeros(size, dtype=np.int64)
+    np.add.at(sums, category_ids, values)
+    return sums
+
+
+# an Accumulator with the same numbers as clean() + add_store() on the store,
+# without touching the store. the dirty rows are counted by reason with masks;
+# only the previewed ones (and with rejects, all of them) are turned into rows
+def numpy_report(
+    store: TransactionStore,
+    top_n: int | None = None,
+    path: str = "",
+    rejects: "RejectWriter | None" = None,
+) -> Accumulator:
+    report = Accumulator(top_n)
+    size = len(store)
+    if size == 0:
+        return report
+
+    cents, dates, category_ids, description_ids = numpy_columns(store)
+    categories = store.categories
+
+    bad_amounts = numpy_mask(size, store.bad_amounts)
+
+    # the --rules category fills in empty categories, like dirty_reason() does
+    empty_category = categories.ids.get("")
+    if RULES is not None and empty_category is not None:
+        rule_categories = np.array(store_rule_categories(store), dtype=np.int32)
+        fill = (category_ids == empty_category) & ~bad_amounts
+        category_ids = np.where(fill, rule_categories[description_ids], category_ids)
+
+    # the same rules as dirty_reason(), one mask per DIRTY_REASONS entry
+    missing_amounts = numpy_mask(size, (i for i, text in store.bad_amounts.items() if not text))
+    bad_dates = numpy_mask(size, store.bad_dates)
+    reason_masks = {
+        "bad_amount": bad_amounts & ~missing_amounts,
+        "missing_amount": missing_amounts,
+        "missing_date": (dates == 0) & ~bad_dates,
+        "missing_description": description_ids == store.descriptions.ids.get("", -1),
+        "zero_amount": cents == 0,
+        "missing_category": category_ids == categories.ids.get("", -1),
+    }
+
+    # a row is counted under the first reason that applies to it
+    clean = np.ones(size, dtype=bool)
+    for reason in DIRTY_REASONS:
+        count = int((clean & reason_masks[reason]).sum())
+        if count:
+            report.dirty_reasons[reason] = count
+        clean &= ~reason_masks[reason]
+
+    dirty_rows = np.flatnonzero(~clean)
+    if rejects is None:
+        dirty_rows = dirty_rows[: report.preview_size]
+    for i in dirty_rows.tolist():
+        category_id = int(category_ids[i])
+        reason = store.dirty_reason(i, category_id)
+        row = store.row(i)
+        row["category"] = categories.strings[category_id]  # may come from --rules
+        if len(report.dirty_preview) < report.preview_size:
+            report.dirty_preview.append((path, i + 2, reason, row))
+        if rejects is not None:
+            rejects.write(i + 2, reason, row)
+
+    # check_amount_symbol(): income is positive, everything else negative
+    income_id = categories.ids.get("Income", -1)
+    is_income = category_ids == income_id
+    amounts = np.where(is_income, np.abs(cents), -np.abs(cents))
+
+    clean_ids = category_ids[clean]
+    clean_amounts = amounts[clean]
+    report.clean_count = int(clean_ids.size)
+    report.dirty_count = size - report.clean_count
+    if report.clean_count == 0:
+        return report
+
+    clean_income = is_income[clean]
+    report.total_income = int(clean_amounts[clean_income].sum())
+    report.total_spending = -int(clean_amounts[~clean_income].sum())
+    report.min_cents = int(clean_amounts.min())
+    report.max_cents = int(clean_amounts.max())
+
+    # categories in order of first clean row, like the python dicts
+    sums = numpy_category_sums(clean_ids, clean_amounts, len(categories))
+    counts = np.bincount(clean_ids, minlength=len(categories))
+    _, first_rows = np.unique(clean_ids, return_index=True)
+    for category_id in clean_ids[np.sort(first_rows)]:
+        name = categories.strings[category_id]
+        report.category_cents[name] = int(sums[category_id])
+        report.category_counts[name] = int(counts[category_id])
+
+    # per description first (they are deduplicated), then folded per merchant
+    if report.by_merchant:
+        spending = ~clean_income
+        clean_descriptions = description_ids[clean][spending]
+        size = len(store.descriptions)
+        sums = numpy_category_sums(clean_descriptions, clean_amounts[spending], size)
+        counts = np.bincount(clean_descriptions, minlength=size)
+        for description_id in np.flatnonzero(counts).tolist():
+            merchant = canonical_merchant(store.descriptions.strings[description_id])
+            report.add_merchant(merchant, int(sums[description_id]), int(counts[description_id]))
+
+    # top expenses: np.argpartition finds the top_n-th largest amount spent,
+    # and only the rows at or above it go through the heaps (so ties are broken
+    # exactly like the python path does)
+    if report.top_n <= 0:
+        return report
+
+    clean_rows_at = np.flatnonzero(clean)
+    expenses = clean_amounts < 0
+    expense_ids = clean_ids[expenses]
+    # categories in order of first expense, like the python top_by_category
+    _, first_rows = np.unique(expense_ids, return_index=True)
+    expense_categories = expense_ids[np.sort(first_rows)].tolist()
+
+    for category_id in [None] + expense_categories:
+        if category_id is None:
+            selected = expenses
+            top = report.top_expenses
+        else:
+            selected = expenses & (clean_ids == category_id)
+            top = TopN(report.top_n)
+            report.top_by_category[categories.strings[category_id]] = top
+
+        rows_at = clean_rows_at[selected]
+        spent = -clean_amounts[selected]
+        if rows_at.size > report.top_n:
+            kth = np.argpartition(spent, -report.top_n)[-report.top_n :]
+            rows_at = rows_at[spent >= spent[kth].min()]
+
+        for i in rows_at.tolist():
+            row = store.row(i)
+            category = categories.strings[category_ids[i]]  # may come from --rules
+            top.add((-int(amounts[i]), row["date"], row["description"], category))
+
+    return report
+
+
+# ============================================================
+# binary parse cache (FILE.fincache)
+# ============================================================
+# layout, all numbers in native byte order:
+#   8 bytes   magic
+#   8 bytes   length of the json header
+#   header    key (path, size, mtime, content hash), string tables, bad values
+#   padding   up to a multiple of 8 bytes
+#   columns   cents (8 bytes/row), dates, category ids, description ids (4 each)
+# the columns are used straight from a memory map, so loading is near instant.
+# only the parse is saved: the rows are cleaned and aggregated on every run.
+
+CACHE_MAGIC = b"FINCACH1"
+CACHE_SUFFIX = ".fincache"
+
+# the content hash covers this many bytes at the start and at the end of a file
+HASH_SAMPLE_BYTES = 1 << 20
+
+
+def cache_path(path: str) -> str:
+    return path + CACHE_SUFFIX
+
+
+# hash of the size plus the first and last HASH_SAMPLE_BYTES of the file (or of
+# its first size bytes). hashing everything would cost a full read of the file,
+# which is exactly what the cache and the ingest state are there to avoid
+def content_hash(path: str, size: int | None = None) -> str:
+    if size is None:
+        size = os.path.getsize(path)
+    digest = hashlib.blake2b(str(size).encode(), digest_size=16)
+    with open(path, "rb") as f:
+        digest.update(f.read(min(size, HASH_SAMPLE_BYTES)))
+        if size > HASH_SAMPLE_BYTES:
+            tail_start = max(HASH_SAMPLE_BYTES, size - HASH_SAMPLE_BYTES)
+            f.seek(tail_start)
+            digest.update(f.read(size - tail_start))
+    return digest.hexdigest()
+
+
+# write the chunks to target. they go to a temp file first, which is then
+# renamed, so a crash never leaves a half written file behind
+def write_atomically(target: str, chunks: Iterable[bytes]) -> None:
+    temp_path = f"{target}.{os.getpid()}.tmp"
+    try:
+        with open(temp_path, "wb") as f:
+            for chunk in chunks:
+                f.write(chunk)
+            f.flush()
+            os.fsync(f.fileno())
+        os.replace(temp_path, target)
+    finally:
+        if os.path.exists(temp_path):
+            os.remove(temp_path)
+
+
+# everything a cache file has to match before it can be trusted
+def cache_key(path: str) -> dict:
+    stat = os.stat(path)
+    return {
+        "path": os.path.abspath(path),
+        "size": stat.st_size,
+        "mtime_ns": stat.st_mtime_ns,
+        "hash": content_hash(path),
+        "extra_decimals": SETTINGS["extra_decimals"],
+        "byteorder": sys.byteorder,
+    }
+
+
+# write store to path's cache file
+def write_store_cache(path: str, store: TransactionStore) -> None:
+    header = cache_key(path)
+    header["rows"] = len(store)
+    header["categories"] = store.categories.strings
+    header["descriptions"] = store.descriptions.strings
+    header["bad_amounts"] = list(store.bad_amounts.items())
+    header["bad_dates"] = list(store.bad_dates.items())
+    header_bytes = json.dumps(header).encode("utf-8")
+    padding = -(16 + len(header_bytes)) % 8
+
+    chunks = [CACHE_MAGIC, len(header_bytes).to_bytes(8, "little"), header_bytes]
+    chunks.append(b"\0" * padding)
+    for column in [store.cents, store.dates, store.category_ids, store.description_ids]:
+        chunks.append(memoryview(column).cast("B"))
+    write_atomically(cache_path(path), chunks)
+
+
+# the store saved in path's cache file, or None if there is no valid cache.
+# columns are views into a private (copy on write) memory map: clean() can
+# still fix signs in place, but nothing is ever written back to the file
+def read_store_cache(path: str) -> TransactionStore | None:
+    target = cache_path(path)
+    try:
+        f = open(target, "rb")
+    except FileNotFoundError:
+        return None
+
+    with f:
+        if f.read(8) != CACHE_MAGIC:
+            return None
+        header_size = int.from_bytes(f.read(8), "little")
+        try:
+            header = json.loads(f.read(header_size))
+        except ValueError:
+            return None
+
+        key = cache_key(path)
+        if any(header.get(name) != value for name, value in key.items()):
+            return None
+
+        rows = header["rows"]
+        start = 16 + header_size + (-(16 + header_size) % 8)
+        if os.fstat(f.fileno()).st_size != start + rows * 20:
+            return None
+
+        store = TransactionStore(
+            StringTable.from_strings(header["categories"]),
+            StringTable.from_strings(header["descriptions"]),
+        )
+        store.bad_amounts = {i: text for i, text in header["bad_amounts"]}
+        store.bad_dates = {i: text for i, text in header["bad_dates"]}
+        if rows == 0:
+            return store
+
+        # the memory map stays open for as long as the views are alive
+        mapped = memoryview(mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_COPY))
+
+    store.cents = mapped[start : start + rows * 8].cast("q")
+    start += rows * 8
+    store.dates = mapped[start : start + rows * 4].cast("i")
+    start += rows * 4
+    store.category_ids = mapped[start : start + rows * 4].cast("i")
+    start += rows * 4
+    store.description_ids = mapped[start : start + rows * 4].cast("i")
+    return store
+
+
+# (store, parsed) for path: the store from its cache when that is still
+# valid (parsed is False), otherwise parsed from the csv and cached for the
+# next run. it is the raw parse, the caller still cleans and aggregates it
+def load_or_parse_store(path: str) -> tuple:
+    store = read_store_cache(path)
+    if store is not None:
+        return store, False
+    store = read_store(path)
+    write_store_cache(path, store)
+    return store, True
+
+
+# ============================================================
+# incremental ingestion of growing exports (FILE.finstate)
+# ============================================================
+# bank exports only ever grow at the end. the state file remembers how far a
+# file was ingested (byte offset and line count) together with the report up
+# to there, so the next run only parses the new tail and folds it in. if the
+# ingested prefix changed (different hash, or the file got shorter), the state
+# is thrown away and the file is parsed again from the start. the prefix hash
+# covers every byte: an edit in the middle of a file must not go unnoticed.
+
+STATE_SUFFIX = ".finstate"
+
+# bytes read at a time while hashing the ingested prefix
+PREFIX_HASH_BLOCK_BYTES = 1 << 20
+
+
+def state_path(path: str) -> str:
+    return path + STATE_SUFFIX
+
+
+# feed the bytes of path between start and end to digest, and return it. the
+# digest of a longer prefix continues from the one of a shorter prefix
+def hash_range(path: str, start: int, end: int, digest=None):
+    if digest is None:
+        digest = hashlib.blake2b(digest_size=16)
+    with open(path, "rb") as f:
+        f.seek(start)
+        left = end - start
+        while left > 0 and (block := f.read(min(left, PREFIX_HASH_BLOCK_BYTES))):
+            digest.update(block)
+            left -= len(block)
+    return digest
+
+
+# the saved ingest state of path, or None if there is none or the part of the
+# file it covers has changed since. state["digest"] is the prefix hash object
+def read_ingest_state(path: str) -> dict | None:
+    try:
+        with open(state_path(path), encoding="utf-8") as f:
+            state = json.load(f)
+    except (FileNotFoundError, ValueError):
+        return None
+
+    offset = state.get("offset", -1)
+    if (
+        state.get("path") != os.path.abspath(path)
+        or state.get("extra_decimals") != SETTINGS["extra_decimals"]
+        or state.get("report", {}).get("top_n") != SETTINGS["top_n"]
+        or state.get("report", {}).get("by_merchant") != SETTINGS["merchants"]
+        or state.get("merchant_names") != MERCHANT_NAMES_VERSION
+        or state.get("rules") != (RULES.signature if RULES else None)
+        or state.get("rejects", False) != SETTINGS["rejects"]
+        or not 0 < offset <= os.path.getsize(path)
+        or state.get("rejects_file") != rejects_identity(path)
+    ):
+        return None
+
+    digest = hash_range(path, 0, offset)
+    if state.get("prefix_hash") != digest.hexdigest():
+        return None
+
+    state["digest"] = digest
+    state["report"] = Accumulator.from_dict(state["report"])
+    return state
+
+
+# prefix_hash is the hash_range() hex digest of the first offset bytes
+def write_ingest_state(
+    path: str, offset: int, lines: int, report: Accumulator, prefix_hash: str
+) -> None:
+    state = {
+        "path": os.path.abspath(path),
+        "extra_decimals": SETTINGS["extra_decimals"],
+        "offset": offset,
+        "lines": lines,
+        "prefix_hash": prefix_hash,
+        "merchant_names": MERCHANT_NAMES_VERSION,
+        "rules": RULES.signature if RULES else None,
+        "rejects": SETTINGS["rejects"],
+        "rejects_file": rejects_identity(path),
+        "report": report.to_dict(),
+    }
+    write_atomically(state_path(path), [json.dumps(state).encode("utf-8")])
+
+
+# [size, mtime_ns] of path's reject file with --rejects, else None. the state
+# only appends to a reject file it wrote itself: after any other run rewrote
+# (or removed) the file, the state is dropped and the file is written afresh
+def rejects_identity(path: str) -> list | None:
+    if not SETTINGS["rejects"]:
+        return None
+    try:
+        stat = os.stat(rejects_path(path))
+    except FileNotFoundError:
+        return None
+    return [stat.st_size, stat.st_mtime_ns]
+
+
+# the report for path, parsing only what was appended since the last run.
+# only complete lines are saved in the state: a half written last line is
+# reported this time but parsed again next time, once it is finished.
+# the rows and bytes parsed by this call are added to parsed, when given
+def incremental_report(
+    path: str, preview_size: int = DIRTY_PREVIEW_SIZE, parsed: dict | None = None
+) -> Accumulator:
+    if parsed is None:
+        parsed = {"rows": 0, "bytes": 0}
+
+    # byte offsets into a compressed file mean nothing, it is read in full
+    if compression(path):
+        report = stream_report(path, preview_size)
+        parsed["rows"] += report.clean_count + report.dirty_count
+        parsed["bytes"] += os.path.getsize(path)
+        return report
+
+    size = os.path.getsize(path)
+    state = read_ingest_state(path)
+
+    if state is not None:
+        offset = state["offset"]
+        lines = state["lines"]
+        report = state["report"]
+        digest = state["digest"]
+    else:
+        # start right after the header line
+        with open(path, "rb") as f:
+            header = f.readline()
+        offset = len(header)
+        lines = 1 if header else 0
+        report = Accumulator(preview_size=preview_size)
+        digest = hash_range(path, 0, offset)
+
+    if offset >= size:
+        return report
+
+    with open(path, "rb") as f, mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ) as mm:
+        complete_end = mm.rfind(b"\n", offset, size) + 1
+
+    # the new complete lines go into the saved state. their rejects are
+    # appended to the reject file, which starts over with the state
+    if complete_end > offset:
+        tail = stream_range(path, offset, complete_end, preview_size)
+        shift_lines(tail, lines)
+        if tail.rejects_part:
+            append_rejects(path, tail.rejects_part, lines, state is None)
+        report.merge(tail)
+        parsed["rows"] += tail.clean_count + tail.dirty_count
+        parsed["bytes"] += complete_end - offset
+        hash_range(path, offset, complete_end, digest)
+        offset = complete_end
+        lines += tail.line_count
+        write_ingest_state(path, offset, lines, report, digest.hexdigest())
+
+    # an unfinished last line only counts for this run, it is not rejected yet
+    if offset < size:
+        tail = stream_range(path, offset, size, preview_size)
+        shift_lines(tail, lines)
+        if tail.rejects_part:
+            os.remove(tail.rejects_part)
+        report.merge(tail)
+        parsed["rows"] += tail.clean_count + tail.dirty_count
+        parsed["bytes"] += size - offset
+
+    return report
+
+
+# ============================================================
+# sqlite store (--sqlite DB)
+# ============================================================
+# the clean rows of every file ever analyzed, kept in one sqlite database, so
+# a report over years of exports is a handful of indexed queries instead of a
+# reparse of every file. files are streamed in and bulk-loaded with
+# executemany() in batches, one transaction per file, with the database in
+# WAL mode. a file is loaded again only when it (or a setting that changes
+# how rows are cleaned) has changed since.
+
+# rows handed to one executemany() call
+SQLITE_BATCH_ROWS = 50_000
+
+SQLITE_SCHEMA = """
+CREATE TABLE IF NOT EXISTS files (
+    id INTEGER PRIMARY KEY,
+    path TEXT NOT NULL UNIQUE,
+    key TEXT NOT NULL,
+    dirty_count INTEGER NOT NULL,
+    dirty_reasons TEXT NOT NULL,
+    dirty_preview TEXT NOT NULL
+);
+CREATE TABLE IF NOT EXISTS transactions (
+    file_id INTEGER NOT NULL REFERENCES files(id),
+    date TEXT NOT NULL,
+    description TEXT NOT NULL,
+    merchant TEXT NOT NULL,
+    amount INTEGER NOT NULL,
+    category TEXT NOT NULL
+);
+CREATE INDEX IF NOT EXISTS transactions_date ON transactions(date);
+CREATE INDEX IF NOT EXISTS transactions_category ON transactions(category, amount);
+CREATE INDEX IF NOT EXISTS transactions_merchant ON transactions(merchant, amount);
+CREATE INDEX IF NOT EXISTS transactions_file ON transactions(file_id);
+"""
+
+
+class SqliteStore:
+    def __init__(self, path: str) -> None:
+        self.connection = sqlite3.connect(path)
+        self.connection.execute("PRAGMA journal_mode=WAL")
+        self.connection.execute("PRAGMA synchronous=NORMAL")
+        self.connection.executescript(SQLITE_SCHEMA)
+
+    def close(self) -> None:
+        self.connection.close()
+
+    # everything that decides which rows of path are clean, and how
+    def file_key(self, path: str) -> str:
+        key = cache_key(path)
+        key["rules"] = RULES.signature if RULES else None
+        key["merchant_names"] = MERCHANT_NAMES_VERSION
+        return json.dumps(key, sort_keys=True)
+
+    # load the clean rows of a csv, unless the same file is already loaded.
+    # returns how many rows were read (0 when it was skipped)
+    def ingest(self, path: str) -> int:
+        absolute = os.path.abspath(path)
+        key = self.file_key(path)
+        known = self.connection.execute(
+            "SELECT id, key FROM files WHERE path = ?", (absolute,)
+        ).fetchone()
+        if known is not None and known[1] == key:
+            return 0
+
+        dirty = Accumulator()
+
+        with self.connection, open_rejects(path) as rejects:
+            if known is not None:
+                self.connection.execute("DELETE FROM transactions WHERE file_id = ?", (known[0],))
+                self.connection.execute("DELETE FROM files WHERE id = ?", (known[0],))
+            file_id = self.connection.execute(
+                "INSERT INTO files (path, key, dirty_count, dirty_reasons, dirty_preview)"
+                " VALUES (?, ?, 0, '{}', '[]')",
+                (absolute, key),
+            ).lastrowid
+
+            def on_dirty(line: int, row: dict, reason: str) -> None:
+                dirty.add_dirty(path, line, row, reason)
+                if rejects is not None:
+                    rejects.write(line, reason, row)
+
+            clean = iter_clean_rows(iter_dictionaries(iter_csv(path)), on_dirty)
+            values = (
+                (
+                    file_id,
+                    row["date"],
+                    row["description"],
+                    canonical_merchant(row["description"]),
+                    row["amount"],
+                    row["category"],
+                )
+                for _, row in clean
+            )
+            clean_count = 0
+            while batch := list(itertools.islice(values, SQLITE_BATCH_ROWS)):
+                self.connection.executemany(
+                    "INSERT INTO transactions"
+                    " (file_id, date, description, merchant, amount, category)"
+                    " VALUES (?, ?, ?, ?, ?, ?)",
+                    batch,
+                )
+                clean_count += len(batch)
+
+            self.connection.execute(
+                "UPDATE files SET dirty_count = ?, dirty_reasons = ?, dirty_preview = ?"
+                " WHERE id = ?",
+                (
+                    dirty.dirty_count,
+                    json.dumps(dirty.dirty_reasons),
+                    json.dumps(dirty.dirty_preview),
+                    file_id,
+                ),
+            )
+
+        return clean_count + dirty.dirty_count
+
+    # " WHERE ..." (and its parameters) limiting rows to a date range. the
+    # extra conditions come after the date ones, so the parameters of their
+    # "?" placeholders go after the returned ones
+    def date_filter(self, start: str | None, end: str | None, *conditions: str) -> tuple:
+        dates = []
+        parameters = []
+        # the dates are compared as text, so the bounds have to be YYYY-MM-DD
+        if start:
+            dates.append("date >= ?")
+            parameters.append(iso_date(start))
+        if end:
+            dates.append("date <= ?")
+            parameters.append(iso_date(end))
+        conditions = dates + list(conditions)
+        where = " WHERE " + " AND ".join(conditions) if conditions else ""
+        return where, parameters
+
+    # same result as spending_by_category() on the rows of the date range
+    def spending_by_category(self, start: str | None = None, end: str | None = None) -> dict:
+        where, parameters = self.date_filter(start, end, "category != 'Income'")
+        return dict(
+            self.connection.execute(
+                f"SELECT category, SUM(amount) FROM transactions{where}"
+                " GROUP BY category ORDER BY MIN(rowid)",
+                parameters,
+            )
+        )
+
+    # same result as compute_income_and_spending() on the rows of the date range
+    def income_and_spending(self, start: str | None = None, end: str | None = None) -> dict:
+        where, parameters = self.date_filter(start, end)
+        total_income, total_spending = self.connection.execute(
+            "SELECT"
+            " COALESCE(SUM(CASE WHEN category = 'Income' THEN amount END), 0),"
+            " COALESCE(-SUM(CASE WHEN category != 'Income' THEN amount END), 0)"
+            f" FROM transactions{where}",
+            parameters,
+        ).fetchone()
+        return {"total_income": total_income, "total_spending": total_spending}
+
+    # the same Accumulator the other modes build, over every loaded row in
+    # the date range. the dirty counts cover every loaded file
+    def report(
+        self, start: str | None = None, end: str | None = None, top_n: int | None = None
+    ) -> Accumulator:
+        report = Accumulator(top_n)
+        query = self.connection.execute
+        where, parameters = self.date_filter(start, end)
+
+        # categories in order of their first row, like the python dicts
+        for category, amount, count in query(
+            f"SELECT category, SUM(amount), COUNT(*) FROM transactions{where}"
+            " GROUP BY category ORDER BY MIN(rowid)",
+            parameters,
+        ):
+            report.category_cents[category] = amount
+            report.category_counts[category] = count
+            report.clean_count += count
+            if category == "Income":
+                report.total_income += amount
+            else:
+                report.total_spending -= amount
+
+        report.min_cents, report.max_cents = query(
+            f"SELECT MIN(amount), MAX(amount) FROM transactions{where}", parameters
+        ).fetchone()
+
+        # expenses come out in TopN's order: most spent first, ties broken by
+        # the later date, description and category
+        top_expenses = (
+            "SELECT -amount, date, description, category FROM transactions{}"
+            " ORDER BY amount, date DESC, description DESC, category DESC LIMIT ?"
+        )
+        if report.top_n > 0:
+            where, parameters = self.date_filter(start, end, "amount < 0")
+            for expense in query(top_expenses.format(where), parameters + [report.top_n]):
+                report.top_expenses.add(expense)
+
+            # categories in order of their first expense
+            categories = query(
+                f"SELECT category FROM transactions{where} GROUP BY category ORDER BY MIN(rowid)",
+                parameters,
+            ).fetchall()
+            where, parameters = self.date_filter(start, end, "amount < 0", "category = ?")
+            for (category,) in categories:
+                top = report.top_by_category[category] = TopN(report.top_n)
+                for expense in query(
+                    top_expenses.format(where), [*parameters, category, report.top_n]
+                ):
+                    top.add(expense)
+
+        if report.by_merchant:
+            where, parameters = self.date_filter(start, end, "category != 'Income'")
+            for merchant, amount, count in query(
+                f"SELECT merchant, SUM(amount), COUNT(*) FROM transactions{where}"
+                " GROUP BY merchant ORDER BY MIN(rowid)",
+                parameters,
+            ):
+                report.add_merchant(merchant, amount, count)
+
+        for count, reasons, preview in query(
+            "SELECT dirty_count, dirty_reasons, dirty_preview FROM files ORDER BY id"
+        ):
+            report.dirty_count += count
+            for reason, reason_count in json.loads(reasons).items():
+                report.dirty_reasons[reason] = report.dirty_reasons.get(reason, 0) + reason_count
+            room = report.preview_size - len(report.dirty_preview)
+            report.dirty_preview.extend(tuple(entry) for entry in json.loads(preview)[:room])
+
+        return report
+
+
 # print list neatly
 def print_list(items):
-
-    i = 1
-    for item in items:
-        print(i, ".", item)
-        i += 1
+    write_lines(f"{i} . {item}" for i, item in enumerate(items, 1))
 
 
 # print dictionary neatly
 def print_dict(d):
-    for key in d:
-        print(key, ":", d[key])
+    write_lines(f"{key} : {d[key]}" for key in d)
 
 
 if __name__ == "__main__":
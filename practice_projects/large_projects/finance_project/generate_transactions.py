@@ -0,0 +1,279 @@
+"""
+Synthetic transaction generator for the Personal Finance Transaction Analyzer
+
+Writes a CSV in the same format as transactions.csv, of any size, for load
+testing and benchmarks:
+
+    python generate_transactions.py big.csv --rows 10000000
+    python generate_transactions.py huge.csv --size 10G --seed 7
+    python generate_transactions.py noisy.csv --rows 100000 --bad-amount 0.05
+
+The output only depends on the options (the seed included), so the same
+command always writes the same file.
+
+- merchants:  a fixed catalog of merchants, each with a category, a typical
+              amount and a popularity. Popular merchants (coffee, groceries)
+              show up far more often than rent or flights, and some are
+              written with store numbers ("AMAZON #1234") or as refunds.
+- amounts:    log-normal around each merchant's typical amount, so most are
+              small and a few are large. Spending is negative, income positive.
+- dates:      spread evenly over --days days from --start, in order, like a
+              bank export.
+- malformed:  rows are broken at the given rates, the same ways the sample
+              file is: "xx.yy" amounts, empty amounts, amounts with three
+              decimals ("-1.999"), flipped signs and empty categories.
+
+Every row gets its own amount and store number, so the number of distinct
+amounts and descriptions grows with the file like it does in real exports
+(and the analyzer's caches see realistic miss rates). Rows are produced in
+chunks of CHUNK_ROWS: the merchants of a chunk are drawn with one
+random.choices() call, the amounts come from one getrandbits() call per row
+and a table of log-normal factors, and each chunk goes to the file in one
+write through a large buffer.
+"""
+
+import argparse
+import math
+import random
+import re
+from datetime import date, timedelta
+
+# (description, category, typical amount in dollars, popularity)
+MERCHANTS = [
+    ("Starbucks", "Food", 5.50, 60),
+    ("Coffee", "Food", 3.75, 40),
+    ("Whole Foods", "Food", 68.00, 30),
+    ("Safeway", "Food", 54.00, 30),
+    ("Chipotle", "Food", 12.50, 25),
+    ("Uber Eats", "Food", 28.00, 15),
+    ("Amazon", "Shopping", 35.00, 45),
+    ("Target", "Shopping", 42.00, 25),
+    ("Walmart", "Shopping", 38.00, 20),
+    ("Best Buy", "Shopping", 160.00, 4),
+    ("IKEA", "Shopping", 120.00, 2),
+    ("Shell", "Transport", 45.00, 20),
+    ("Gas Station", "Transport", 42.00, 15),
+    ("Uber", "Transport", 18.00, 20),
+    ("Delta Air Lines", "Transport", 380.00, 1),
+    ("Netflix", "Entertainment", 15.49, 4),
+    ("Spotify", "Entertainment", 10.99, 4),
+    ("AMC Theatres", "Entertainment", 24.00, 5),
+    ("Steam", "Entertainment", 19.99, 4),
+    ("Rent", "Housing", 1200.00, 2),
+    ("PG&E", "Utilities", 95.00, 2),
+    ("Comcast", "Utilities", 80.00, 2),
+    ("CVS Pharmacy", "Health", 22.00, 8),
+    ("Kaiser Permanente", "Health", 140.00, 1),
+    ("Paycheck", "Income", 2500.00, 4),
+    ("Interest Payment", "Income", 6.00, 2),
+    ("Venmo Transfer", "Income", 45.00, 3),
+]
+
+# merchants whose descriptions sometimes carry a store or reference number
+NUMBERED_MERCHANTS = {"Starbucks", "Amazon", "Target", "Walmart", "Shell", "CVS Pharmacy"}
+
+# log-normal factors exp(0.6 z), drawn once per file: a row's amount is its
+# merchant's typical amount times one of them, plus random cents
+FACTOR_BITS = 16
+
+# rows formatted (and written) per chunk
+CHUNK_ROWS = 100_000
+
+# bytes buffered before the output file is written to
+WRITE_BUFFER_SIZE = 1 << 24
+
+# the ways a row gets broken, and their default rates
+MALFORMED_KINDS = {
+    "bad_amount": 0.002,
+    "empty_amount": 0.001,
+    "extra_decimals": 0.001,
+    "sign_typo": 0.002,
+    "empty_category": 0.002,
+}
+
+SIZE_SUFFIXES = {"": 1, "K": 1 << 10, "M": 1 << 20, "G": 1 << 30, "T": 1 << 40}
+
+
+def main(argv: list | None = None) -> None:
+    args = parse_args(argv)
+    rates = {kind: getattr(args, kind) for kind in MALFORMED_KINDS}
+    rows = args.rows
+    if rows is None:
+        rows = rows_for_size(args.size, args.seed)
+
+    written = write_transactions(
+        args.path,
+        rows,
+        seed=args.seed,
+        start=date.fromisoformat(args.start),
+        days=args.days,
+        rates=rates,
+    )
+    print(f"wrote {rows:,} rows ({written / 2**20:,.1f} MiB) to {args.path}")
+
+
+# read the command line options
+def parse_args(argv: list | None = None) -> argparse.Namespace:
+    parser = argparse.ArgumentParser(description="Synthetic transaction CSV generator")
+    parser.add_argument("path", help="CSV file to write")
+    size = parser.add_mutually_exclusive_group(required=True)
+    size.add_argument("--rows", type=int, help="number of transactions to write")
+    size.add_argument(
+        "--size", type=parse_size, help="approximate file size, like 500M or 10G"
+    )
+    parser.add_argument("--seed", type=int, default=42)
+    parser.add_argument("--start", default="2024-01-01", help="first ISO date")
+    parser.add_argument("--days", type=int, default=730, help="how many days the rows cover")
+    for kind, rate in MALFORMED_KINDS.items():
+        parser.add_argument(
+            "--" + kind.replace("_", "-"),
+            dest=kind,
+            type=float,
+            default=rate,
+            metavar="RATE",
+            help=f"fraction of rows with {kind.replace('_', ' ')} (default {rate})",
+        )
+    return parser.parse_args(argv)
+
+
+# "10G" / "500M" / "123" -> bytes
+def parse_size(text: str) -> int:
+    match = re.fullmatch(r"\s*(\d+(?:\.\d+)?)\s*([KMGT]?)i?B?\s*", text.upper())
+    if not match:
+        raise argparse.ArgumentTypeError(f"not a size: {text!r}")
+    return int(float(match.group(1)) * SIZE_SUFFIXES[match.group(2)])
+
+
+# how many rows make a file of about size bytes, from the average row length
+# of a sample
+def rows_for_size(size: int, seed: int = 42) -> int:
+    rng = random.Random(seed)
+    sample = clean_tails(rng, 1 << 16, lognormal_factors(rng))
+    average = sum(map(len, sample)) / len(sample) + len("2026-01-01,")
+    return max(1, round(size / average))
+
+
+# ============================================================
+# amounts and row tails
+# ============================================================
+
+
+# cents -> "-5.43" / "2500.00"
+def format_amount(cents: int) -> str:
+    dollars, rest = divmod(abs(cents), 100)
+    return f"{'-' if cents < 0 else ''}{dollars}.{rest:02d}"
+
+
+# a signed amount in cents for a merchant: log-normal around its typical
+# amount, negative unless it is income
+def draw_cents(rng: random.Random, typical: float, category: str) -> int:
+    cents = max(1, round(rng.lognormvariate(math.log(typical * 100), 0.6)))
+    return cents if category == "Income" else -cents
+
+
+# the description a bank would show for a merchant
+def draw_description(rng: random.Random, merchant: str) -> str:
+    if merchant in NUMBERED_MERCHANTS and rng.random() < 0.3:
+        return f"{merchant.upper()} #{rng.randint(100, 9999)}"
+    return merchant
+
+
+# one row tail broken in the given way
+def malformed_tail(rng: random.Random, merchant: tuple, kind: str) -> str:
+    name, category, typical, _ = merchant
+    description = draw_description(rng, name)
+    cents = draw_cents(rng, typical, category)
+    amount = format_amount(cents)
+
+    if kind == "bad_amount":
+        amount = rng.choice(["xx.yy", "N/A", "12.3.4", "$$"])
+    elif kind == "empty_amount":
+        amount = ""
+    elif kind == "extra_decimals":
+        amount = f"{amount}{rng.randint(1, 9)}"
+    elif kind == "sign_typo":
+        amount = format_amount(-cents)
+    elif kind == "empty_category":
+        category = ""
+    return f"{description},{amount},{category}"
+
+
+# the 2**FACTOR_BITS log-normal factors clean_tails() scales amounts by
+def lognormal_factors(rng: random.Random) -> list:
+    return [rng.lognormvariate(0, 0.6) for _ in range(1 << FACTOR_BITS)]
+
+
+# count clean "description,amount,category" row tails, merchants drawn by
+# popularity. every row takes one getrandbits() call for its amount, refund
+# and store number, as this is where nearly all of the generator's time goes
+def clean_tails(rng: random.Random, count: int, factors: list) -> list:
+    weights = [merchant[3] for merchant in MERCHANTS]
+    mask = (1 << FACTOR_BITS) - 1
+    tails = []
+    for name, category, typical, _ in rng.choices(MERCHANTS, weights, k=count):
+        # bits 0-15: amount factor, 16-22: extra cents, 23-29: refund or store
+        # number odds, 30 and up: store number
+        bits = rng.getrandbits(48)
+        cents = max(1, int(typical * 100 * factors[bits & mask]) + (bits >> 16 & 127) - 63)
+        if category != "Income":
+            cents = -cents
+
+        description = name
+        # now and then a purchase is refunded
+        if category == "Shopping" and (bits >> 23 & 127) < 4:
+            description = f"Refund {name}"
+            cents = -cents
+        elif name in NUMBERED_MERCHANTS and (bits >> 23 & 127) < 38:
+            description = f"{name.upper()} #{100 + (bits >> 30) % 99_900}"
+        # same text as format_amount(), the float is exact enough for any
+        # cents this generator makes, and formatting it is much cheaper
+        tails.append(f"{description},{cents / 100:.2f},{category}")
+    return tails
+
+
+# ============================================================
+# writing
+# ============================================================
+
+
+# write rows transactions to path, returns the number of bytes written
+def write_transactions(
+    path: str,
+    rows: int,
+    seed: int = 42,
+    start: date = date(2024, 1, 1),
+    days: int = 730,
+    rates: dict | None = None,
+) -> int:
+    rng = random.Random(seed)
+    rates = dict(MALFORMED_KINDS if rates is None else rates)
+    factors = lognormal_factors(rng)
+    weights = [merchant[3] for merchant in MERCHANTS]
+    day_texts = [(start + timedelta(days=day)).isoformat() + "," for day in range(days)]
+
+    written = 0
+    with open(path, "w", newline="", buffering=WRITE_BUFFER_SIZE) as f:
+        written += f.write("date,description,amount,category\n")
+        for first in range(0, rows, CHUNK_ROWS):
+            count = min(CHUNK_ROWS, rows - first)
+            tails = clean_tails(rng, count, factors)
+
+            # break some of them. the expected number per chunk is kept
+            # exact by rounding rate * count up or down at random
+            for kind, rate in rates.items():
+                broken = int(rate * count + rng.random())
+                for i in rng.sample(range(count), min(broken, count)):
+                    merchant = rng.choices(MERCHANTS, weights)[0]
+                    tails[i] = malformed_tail(rng, merchant, kind)
+
+            lines = [
+                day_texts[(first + i) * days // rows] + tail + "\n"
+                for i, tail in enumerate(tails)
+            ]
+            written += f.write("".join(lines))
+
+    return written
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,399 @@
+"""
+Tests for finance.py
+
+    python -m pytest test_finance.py
+
+Every test writes its own CSV files under pytest's tmp_path, so the cache,
+state and reject files they leave behind never touch the real exports.
+"""
+
+import contextlib
+import os
+
+import pytest
+
+import finance
+
+HEADER = "date,description,amount,category\n"
+
+# clean rows and one of every kind of dirty row, repeated with other dates
+SAMPLE_ROWS = [
+    "2026-01-{day:02},Starbucks #{day},-5.43,Food",
+    "2026-01-{day:02},Amazon,-129.99,Shopping",
+    "2026-01-{day:02},Paycheck,\"2,500.00\",Income",
+    "2026-01-{day:02},Refund Amazon,29.99,Shopping",
+    "2026-01-{day:02},Unknown Merchant,-10.00,",
+    "2026-01-{day:02},Target,xx.yy,Shopping",
+    "2026-01-{day:02},Bad Row Missing Amount,,Food",
+    "2026-01-{day:02},Too Many Decimals,-1.999,Food",
+    "2026-01-{day:02},Zero,0.00,Food",
+    ",No Date,-1.00,Food",
+    "2026-01-{day:02},,-1.00,Food",
+    "2026-01-{day:02},Positive Spending Typo,(12.34),Food",
+]
+
+# keep every dirty row in the preview, so whole previews can be compared
+PREVIEW_SIZE = 10_000
+
+
+@pytest.fixture(autouse=True)
+def default_settings():
+    saved = dict(finance.SETTINGS)
+    yield
+    finance.configure(saved)
+
+
+# a csv of days * len(SAMPLE_ROWS) rows at tmp_path/name
+def write_sample(tmp_path, days: int = 30, name: str = "sample.csv") -> str:
+    path = str(tmp_path / name)
+    with open(path, "w", newline="") as f:
+        f.write(HEADER)
+        for day in range(1, days + 1):
+            for row in SAMPLE_ROWS:
+                f.write(row.format(day=day % 28 + 1) + "\n")
+    return path
+
+
+def append_lines(path: str, lines: list) -> None:
+    with open(path, "a", newline="") as f:
+        f.writelines(line + "\n" for line in lines)
+
+
+# everything a report says, without the bookkeeping of how it was made.
+# the top-N heaps are compared sorted, their layout depends on merge order
+def summary(report: finance.Accumulator) -> dict:
+    data = report.to_dict()
+    for key in ("path", "line_count", "rejects_part"):
+        data.pop(key, None)
+    data["top_expenses"] = sorted(data["top_expenses"])
+    data["top_by_category"] = {
+        category: sorted(heap) for category, heap in data["top_by_category"].items()
+    }
+    return data
+
+
+# ============================================================
+# parse_cents
+# ============================================================
+
+
+@pytest.mark.parametrize(
+    "text, cents",
+    [
+        ("12.34", 1234),
+        ("-12.34", -1234),
+        ("+12.34", 1234),
+        ("0.05", 5),
+        ("-0.05", -5),
+        ("7", 700),
+        ("5.", 500),
+        (".5", 50),
+        ("3.5", 350),
+        ("(12.34)", -1234),
+        ("1,234.50", 123450),
+        ("-1,234,567.89", -123456789),
+        (" 12.34 ", 1234),
+        ("12.34\n", 1234),
+    ],
+)
+def test_parse_cents(text, cents):
+    assert finance.parse_cents(text) == cents
+
+
+@pytest.mark.parametrize(
+    "text",
+    [
+        "",
+        "-",
+        ".",
+        "xx.yy",
+        ".+2",
+        ".-5",
+        "+-1.00",
+        "1_000.00",
+        "1,23.00",
+        "1234,567.00",
+        "12.3x",
+        "²3.45",
+        "١٢.34",
+        "12.345",
+        "(12.34",
+    ],
+)
+def test_parse_cents_rejects(text):
+    with pytest.raises(ValueError):
+        finance.parse_cents(text)
+
+
+@pytest.mark.parametrize(
+    "text, cents", [("12.345", 1235), ("12.344", 1234), ("-12.345", -1235), ("0.999", 100)]
+)
+def test_parse_cents_rounds_extra_decimals(text, cents):
+    assert finance.parse_cents(text, "round") == cents
+
+
+# ============================================================
+# canonical_merchant
+# ============================================================
+
+
+@pytest.mark.parametrize(
+    "description, merchant",
+    [
+        ("Amazon", "Amazon"),
+        ("Refund Amazon", "Amazon"),
+        ("AMAZON #1234 01/05", "Amazon"),
+        ("POS PURCHASE STARBUCKS #1234 01/05", "Starbucks"),
+        ("Debit Card Purchase Card Factory", "Card Factory"),
+        ("PAYPAL *NETFLIX", "Netflix"),
+        ("PAYPAL *PG&E", "PG&E"),
+        ("PG&E", "PG&E"),
+        ("Credit Karma", "Credit Karma"),
+        ("Card Factory", "Card Factory"),
+        ("Online Bank Transfer", "Online Bank Transfer"),
+        ("CVS Pharmacy", "CVS Pharmacy"),
+        ("ABC Store 12", "ABC"),
+        ("7-Eleven", "7-Eleven"),
+        ("WAL-MART #4521", "Wal-Mart"),
+        ("Amazon.com", "Amazon.com"),
+        ("Refund", "Refund"),
+    ],
+)
+def test_canonical_merchant(description, merchant):
+    assert finance.canonical_merchant(description) == merchant
+
+
+# ============================================================
+# byte ranges (split_ranges, stream_range, merge_ranges)
+# ============================================================
+
+
+@pytest.mark.parametrize("parts", [1, 2, 3, 7])
+def test_ranges_match_stream_report(tmp_path, monkeypatch, parts):
+    path = write_sample(tmp_path)
+    # small enough that the sample is cut into as many ranges as asked for
+    monkeypatch.setattr(finance, "MIN_RANGE_BYTES", 64)
+
+    ranges = finance.split_ranges(path, parts)
+    assert len(ranges) == parts
+    assert ranges[-1][1] == os.path.getsize(path)
+    assert all(end == start for (_, end), (start, _) in zip(ranges, ranges[1:]))
+
+    merged = finance.merge_ranges(
+        (finance.stream_range(path, start, end, PREVIEW_SIZE) for start, end in ranges),
+        PREVIEW_SIZE,
+    )
+    whole = finance.stream_report(path, PREVIEW_SIZE)
+    assert whole.dirty_count > 0
+    assert summary(merged) == summary(whole)
+
+
+def test_ranges_write_the_same_reject_file(tmp_path, monkeypatch):
+    path = write_sample(tmp_path)
+    monkeypatch.setattr(finance, "MIN_RANGE_BYTES", 64)
+    finance.configure({"rejects": True})
+
+    finance.stream_report(path)
+    with open(finance.rejects_path(path)) as f:
+        streamed = f.read()
+    os.remove(finance.rejects_path(path))
+
+    ranges = finance.split_ranges(path, 4)
+    finance.merge_ranges(finance.stream_range(path, start, end) for start, end in ranges)
+    with open(finance.rejects_path(path)) as f:
+        assert f.read() == streamed
+
+
+def test_globs_skip_the_files_written_next_to_an_export(tmp_path):
+    path = write_sample(tmp_path, name="a.csv")
+    finance.configure({"rejects": True})
+    finance.stream_report(path)
+    finance.write_store_cache(path, finance.read_store(path))
+    open(finance.rejects_path(path) + ".123", "w").close()
+
+    assert finance.expand_paths([str(tmp_path / "*.csv")]) == [path]
+    assert finance.expand_paths([str(tmp_path / "*")]) == [path]
+    # a file named on its own is always analyzed
+    assert finance.expand_paths([finance.rejects_path(path)]) == [finance.rejects_path(path)]
+
+
+@pytest.mark.parametrize("mode", [[], ["--columnar"]])
+def test_rollup_and_query_cover_the_filtered_rows(tmp_path, capsys, mode):
+    path = write_sample(tmp_path, days=10)
+    finance.main([path, *mode, "--search", "amazon", "--query", "*", "2026-01-01", "2026-01-31"])
+    # 10 days of "Amazon" -129.99 and "Refund Amazon" 29.99, both spending
+    assert capsys.readouterr().out.endswith("* from 2026-01-01 to 2026-01-31: -159980\n")
+
+    finance.main([path, *mode, "--from", "2026-01-05", "--query", "Shopping", "2026-01-01",
+                  "2026-01-31"])
+    # days 2 to 11, of which 5 to 11 are in the range
+    assert capsys.readouterr().out.endswith("Shopping from 2026-01-01 to 2026-01-31: -111986\n")
+
+
+@pytest.mark.parametrize("mode", [[], ["--columnar"], ["--stream"], ["--backend", "numpy"]])
+def test_merchants_are_spending_only(tmp_path, capsys, mode):
+    path = write_sample(tmp_path, days=10)
+    finance.main([path, "--merchants", *mode])
+    out = capsys.readouterr().out
+    table = out.split("SPENDING BY MERCHANT:\n")[1].split("\n\n")[0]
+    assert "Paycheck" not in table
+    assert "-$" not in table
+    assert table.splitlines()[0].split() == ["Amazon", "$1,599.80", "20", "rows"]
+
+
+@pytest.mark.parametrize(
+    "mode", [[], ["--columnar"], ["--cache"], ["--backend", "numpy"], ["--stream"]]
+)
+@pytest.mark.parametrize("content", ["", HEADER])
+def test_empty_files_give_an_empty_report(tmp_path, capsys, mode, content):
+    path = tmp_path / "empty.csv"
+    path.write_text(content)
+    finance.main([str(path), *mode])
+    assert "ROWS: 0 clean, 0 dirty" in capsys.readouterr().out
+
+
+# ============================================================
+# parse cache (FILE.fincache)
+# ============================================================
+
+
+def test_store_cache_round_trip(tmp_path):
+    path = write_sample(tmp_path)
+    store = finance.read_store(path)
+    finance.write_store_cache(path, store)
+
+    cached = finance.read_store_cache(path)
+    assert cached is not None
+    assert len(cached) == len(store)
+    assert list(cached.cents) == list(store.cents)
+    assert list(cached.dates) == list(store.dates)
+    assert list(cached.category_ids) == list(store.category_ids)
+    assert list(cached.description_ids) == list(store.description_ids)
+    assert cached.categories.strings == store.categories.strings
+    assert cached.descriptions.strings == store.descriptions.strings
+    assert cached.bad_amounts == store.bad_amounts
+    assert cached.bad_dates == store.bad_dates
+
+
+def test_load_or_parse_store_uses_the_cache(tmp_path):
+    path = write_sample(tmp_path)
+    store, parsed = finance.load_or_parse_store(path)
+    assert parsed
+    cached, parsed = finance.load_or_parse_store(path)
+    assert not parsed
+    assert [cached.row(i) for i in range(len(cached))] == [
+        store.row(i) for i in range(len(store))
+    ]
+
+
+def test_store_cache_is_dropped_when_the_csv_changes(tmp_path):
+    path = write_sample(tmp_path)
+    finance.write_store_cache(path, finance.read_store(path))
+    append_lines(path, ["2026-02-01,Late,-1.00,Food"])
+    assert finance.read_store_cache(path) is None
+
+
+def test_store_cache_is_dropped_when_settings_change(tmp_path):
+    path = write_sample(tmp_path)
+    finance.write_store_cache(path, finance.read_store(path))
+    finance.configure({"extra_decimals": "round"})
+    assert finance.read_store_cache(path) is None
+
+
+# ============================================================
+# incremental ingestion (FILE.finstate)
+# ============================================================
+
+
+def test_incremental_report_round_trip(tmp_path):
+    path = write_sample(tmp_path, days=10)
+    first = finance.incremental_report(path, PREVIEW_SIZE)
+    assert summary(first) == summary(finance.stream_report(path, PREVIEW_SIZE))
+    assert os.path.exists(finance.state_path(path))
+
+    # nothing new: the saved report comes back, nothing is parsed
+    parsed = {"rows": 0, "bytes": 0}
+    again = finance.incremental_report(path, PREVIEW_SIZE, parsed=parsed)
+    assert summary(again) == summary(first)
+    assert parsed == {"rows": 0, "bytes": 0}
+
+    # appended rows, dirty ones included, are folded in with their file lines
+    appended = ["2026-02-01,Late,-1.00,Food", "2026-02-02,Late Dirty,oops,Food"]
+    append_lines(path, appended)
+    parsed = {"rows": 0, "bytes": 0}
+    grown = finance.incremental_report(path, PREVIEW_SIZE, parsed=parsed)
+    assert summary(grown) == summary(finance.stream_report(path, PREVIEW_SIZE))
+    assert parsed["rows"] == len(appended)
+
+
+def test_incremental_report_counts_an_unfinished_line_once(tmp_path):
+    path = write_sample(tmp_path, days=10)
+    finance.incremental_report(path, PREVIEW_SIZE)
+    with open(path, "a", newline="") as f:
+        f.write("2026-02-01,Half Written,-1.00,Food")
+
+    partial = finance.incremental_report(path, PREVIEW_SIZE)
+    assert summary(partial) == summary(finance.stream_report(path, PREVIEW_SIZE))
+
+    # once the line is finished it is parsed for good, not counted twice
+    append_lines(path, ["", "2026-02-02,Next,-2.00,Food"])
+    finished = finance.incremental_report(path, PREVIEW_SIZE)
+    assert summary(finished) == summary(finance.stream_report(path, PREVIEW_SIZE))
+
+
+def test_incremental_report_reparses_an_edited_file(tmp_path):
+    path = write_sample(tmp_path, days=10)
+    finance.incremental_report(path, PREVIEW_SIZE)
+
+    # same size, one amount changed in the middle of the ingested part
+    with open(path, "r+b") as f:
+        data = f.read()
+        f.seek(data.index(b"-129.99", len(data) // 2) + 1)
+        f.write(b"9")
+
+    edited = finance.incremental_report(path, PREVIEW_SIZE)
+    expected = finance.stream_report(path, PREVIEW_SIZE)
+    assert summary(edited) == summary(expected)
+    assert edited.category_cents["Shopping"] == expected.category_cents["Shopping"]
+
+
+# ============================================================
+# sqlite store (--sqlite DB)
+# ============================================================
+
+
+# the report of the list path (read_csv, clean_rows, select_dates) for path
+def list_report(path: str, start: str | None = None, end: str | None = None):
+    report = finance.Accumulator()
+    rows = finance.rows_to_dictionaries(finance.read_csv(path))
+
+    def on_dirty(line: int, row: dict, reason: str) -> None:
+        report.add_dirty(path, line, row, reason)
+
+    clean = finance.clean_rows(rows, on_dirty)["clean"]
+    for row in finance.select_dates(clean, start, end):
+        report.add(row)
+    return report
+
+
+@pytest.mark.parametrize(
+    "start, end",
+    [(None, None), ("2026-01-05", "2026-01-20"), ("2026-01-05", None), (None, "2026-01-20")],
+)
+def test_sqlite_report_matches_the_list_path(tmp_path, start, end):
+    path = write_sample(tmp_path)
+    with contextlib.closing(finance.SqliteStore(str(tmp_path / "sample.db"))) as db:
+        assert db.ingest(path) > 0
+        report = db.report(start, end)
+
+    expected = list_report(path, start, end)
+    assert expected.top_by_category
+    assert summary(report) == summary(expected)
+
+
+def test_sqlite_ingest_skips_a_loaded_file(tmp_path):
+    path = write_sample(tmp_path)
+    with contextlib.closing(finance.SqliteStore(str(tmp_path / "sample.db"))) as db:
+        assert db.ingest(path) > 0
+        assert db.ingest(path) == 0
+        assert summary(db.report()) == summary(list_report(path))